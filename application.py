@@ -5,19 +5,18 @@ from PySide6.QtCore import *
 from PySide6.QtGui import *
 
 import sys
-import json
 import os
+import time
 
 import qdarktheme
 
-from datetime import datetime
-
 import logging
 import logging.config
 
 import urllib.request, urllib.error, urllib.parse
 import webbrowser
 
+from metrics import METRICS
 from ocrworker import ScOcrWorker, ScOcrWorkerParams
 from wsworker import WebSocketsWorker
 
@@ -399,27 +398,18 @@ class Window(QtWidgets.QWidget):
 			print(e)
 
 	def closeEvent(self, event):
-		if self.ocr_worker._isRunning:
+		if self.ocr_worker.isRunning():
 			self.terminate_ocr_worker()
 
-	def sendCommandToBrowser(self):
-
-		current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-
-		response = {}
-		response["timestamp"] = current_time
-		for key, param in enumerate(self.g_ocr_coords):
-			response[param.name] = param.value
-
-		self.ws_worker.send(json.dumps(response))
-
 	def init_ws_worker(self):
-		self.ws_worker = WebSocketsWorker(serverAddress=self.SCwebsocketAddress.text())
+		self.ws_worker = WebSocketsWorker(serverAddress=self.SCwebsocketAddress.text(), maxLag=float(self.qsettings.value("SCwsMaxLag", "5.0")))
 		self.ws_worker.error.connect(self.close)
+		# results go from the OCR thread straight to the reactor, not through the GUI event loop
+		self.ocr_worker.publisher.subscribe(self.ws_worker.publish_result)
 		self.ws_worker.start()# Call to start WebSockets server
 
-	def init_ocr_worker(self):
-		self.ocr_worker_params = ScOcrWorkerParams(
+	def create_ocr_worker_params(self):
+		return ScOcrWorkerParams(
 				waitKey=self.SCwaitKey.text(),
 				videoCaptureIndex=self.SCvideoCaptureIndex.text(),
 				rotation=self.SCrotation.text(),
@@ -431,34 +421,72 @@ class Window(QtWidgets.QWidget):
 				cropLeft=self.SCcropLeft.text(),
 				cropTop=self.SCcropTop.text(),
 				autocrop_enabled=False,
-				autocrop_coords=[0,0,0,0]
+				autocrop_coords=[0,0,0,0],
+				roiOnly=self.qsettings.value("SCroiOnly", "1") == "1",
+				changeTolerance=self.qsettings.value("SCchangeTolerance", "8"),
+				lockLayoutFrames=self.qsettings.value("SClockLayoutFrames", "50"),
+				previewEnabled=self.chkPreview.isChecked(),
+				previewInterval=self.qsettings.value("SCpreviewInterval", "200"),
+				previewScale=self.qsettings.value("SCpreviewScale", "0.5"),
+				captureDecimation=self.qsettings.value("SCcaptureDecimation", "1"),
+				captureFps=self.qsettings.value("SCcaptureFps", "0"),
+				sourceFourcc=self.qsettings.value("SCsourceFourcc", ""),
+				sourceWidth=self.qsettings.value("SCsourceWidth", "960"),
+				sourceHeight=self.qsettings.value("SCsourceHeight", "540"),
+				sourceFps=self.qsettings.value("SCsourceFps", "0"),
+				sourceBufferSize=self.qsettings.value("SCsourceBufferSize", "0"),
+				sourceMinGroupHeight=self.qsettings.value("SCsourceMinGroupHeight", "0"),
+				groupThreads=self.qsettings.value("SCgroupThreads", "1")
 				)
 
+	def init_ocr_worker(self):
+		self.ocr_worker_params = self.create_ocr_worker_params()
+
 		self.ocr_worker = ScOcrWorker(self.g_ocr_coords, self.ocr_worker_params)
 		self.ocr_worker.error.connect(self.close)
-		self.ocr_worker.allDigitGroups.connect(self.handler_ocr_result_groups)
-		self.ocr_worker.QImageFrame.connect(self.handler_ocr_preview_image)
+		self.ocr_worker.resultsAvailable.connect(self.handler_ocr_results_available)
+		self.ocr_worker.previewAvailable.connect(self.handler_ocr_preview_available)
 
 	def start_ocr_worker(self):
 		if self.ocr_worker is not None:
 			self.parent().statusBar().showMessage("OCR started", 2000)
-			self.ocr_worker.run()
+			self.ocr_worker.start()
 
 	def pause_ocr_worker(self):
 		if self.ocr_worker is not None:
 			self.ocr_worker.pause()
 
+	def reset_ocr_layout(self):
+		# digit boxes are found again from the contours, e.g. after the camera moved
+		if self.ocr_worker is not None:
+			self.ocr_worker.reset_layout()
+
 	def terminate_ocr_worker(self):
 		if self.ocr_worker is not None:
 			self.ocr_worker.kill()
 
-	@Slot(list)
+	@Slot()
+	def handler_ocr_preview_available(self):
+		QImageFrame = self.ocr_worker.previews.take()
+		if QImageFrame is not None:
+			self.handler_ocr_preview_image(QImageFrame)
+
+	@Slot()
+	def handler_ocr_results_available(self):
+		result = self.ocr_worker.results.take()
+		if result is not None:
+			METRICS.observe("result_gui", time.monotonic() - result.timestamp)
+			self.handler_ocr_result_groups(result)
+
 	def handler_ocr_preview_image(self, QImageFrame):
 		_pixmapRaw = QPixmap.fromImage(QImageFrame[0])
 		_pixmapProcessed = QPixmap.fromImage(QImageFrame[1])
+		_previewScale = QImageFrame[2]
+		QImageFrame[3].release() # the QImages wrap worker buffers, the pixmaps are copies
 
-		self.previewOriginalWidth = _pixmapProcessed.width()
-		self.previewOriginalHeight = _pixmapProcessed.height()
+		# click coordinates map to the full-size processed frame, not the downscaled preview
+		self.previewOriginalWidth = int(_pixmapProcessed.width() / _previewScale)
+		self.previewOriginalHeight = int(_pixmapProcessed.height() / _previewScale)
 
 		self.previewImageRaw.setPixmap(_pixmapRaw.scaled(300, 300, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
 		self.previewImageProcessed.setPixmap(_pixmapProcessed.scaled(self.previewImageProcessed.width(), self.previewImageProcessed.height(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
@@ -468,12 +496,12 @@ class Window(QtWidgets.QWidget):
 			self.ui_crop_window.previewImage.setPixmap(_pixmapRaw.scaled(self.ui_crop_window.previewImage.width(), self.ui_crop_window.previewImage.height(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
 
 	@Slot(object)
-	def handler_ocr_result_groups(self, digit_groups):
-		for i, digitgrp in enumerate(digit_groups):
-			self.g_ocr_coords[i].lbl_value.setText(str(digitgrp.value))
-			self.g_ocr_coords[i].value = digitgrp.value
-
-		self.sendCommandToBrowser()
+	def handler_ocr_result_groups(self, result):
+		for i, (name, value) in enumerate(result.groups):
+			if i >= len(self.g_ocr_coords):
+				break
+			self.g_ocr_coords[i].lbl_value.setText(str(value))
+			self.g_ocr_coords[i].value = value
 
 	@Slot(object)
 	def handler_autocrop_save(self, crop_coords):
@@ -537,22 +565,10 @@ class Window(QtWidgets.QWidget):
 		self.qsettings.setValue("SCwaitKey", self.SCwaitKey.text())
 		self.qsettings.setValue("SCvideoCaptureIndex", self.SCvideoCaptureIndex.text())
 		self.qsettings.setValue("SCwebsocketAddress", self.SCwebsocketAddress.text())
+		self.qsettings.setValue("SCpreview", "1" if self.chkPreview.isChecked() else "0")
 		
 		try:
-			self.ocr_worker_params = ScOcrWorkerParams(
-				waitKey=self.SCwaitKey.text(),
-				videoCaptureIndex=self.SCvideoCaptureIndex.text(),
-				rotation=self.SCrotation.text(),
-				skewx=self.SCskewx.text(),
-				skewy=self.SCskewy.text(),
-				erosion=self.SCerosion.text(),
-				dilate=self.SCdilate.text(),
-				threshold=self.SCthreshold.text(),
-				cropLeft=self.SCcropLeft.text(),
-				cropTop=self.SCcropTop.text(),
-				autocrop_enabled=False,
-				autocrop_coords=[0,0,0,0]
-				)
+			self.ocr_worker_params = self.create_ocr_worker_params()
 			self.ocr_worker.update_params(self.ocr_worker_params)
 			self.ocr_worker.update_ocr_coordinates(self.g_ocr_coords)
 		except Exception as e:
@@ -698,7 +714,7 @@ class Window(QtWidgets.QWidget):
 		self.SCcropTop = QtWidgets.QLineEdit(self.qsettings.value("TCrop", "0"))
 		self.SCvideoCaptureIndex = QtWidgets.QLineEdit(self.qsettings.value("SCvideoCaptureIndex", '0'))
 		self.SCwebsocketAddress = QtWidgets.QLineEdit(self.qsettings.value("SCwebsocketAddress", 'ws://localhost:9000'))
-		self.SCwaitKey = QtWidgets.QLineEdit(self.qsettings.value("SCwaitKey", '300'))
+		self.SCwaitKey = QtWidgets.QLineEdit(self.qsettings.value("SCwaitKey", '40'))
 
 		self.rotateSlider = QtWidgets.QSlider(Qt.Orientation.Horizontal)
 		self.rotateSlider.setMinimum(-45)
@@ -830,6 +846,10 @@ class Window(QtWidgets.QWidget):
 		self.startSCOCRButton = QtWidgets.QPushButton("Start OCR")
 		self.pauseSCOCRButton = QtWidgets.QPushButton("Pause OCR")
 		self.terminateSCOCRButton = QtWidgets.QPushButton("Stop OCR")
+		self.resetLayoutButton = QtWidgets.QPushButton("Reset digit layout")
+		self.chkPreview = QtWidgets.QCheckBox("Preview enabled")
+		self.chkPreview.setChecked(self.qsettings.value("SCpreview", "1") == "1")
+		self.chkPreview.clicked.connect(self.update_state)
 
 		self.previewImageRaw = QtWidgets.QLabel("Camera raw feed not available.")
 		self.previewImageRaw.mousePressEvent = self.handle_preview_video_click
@@ -838,6 +858,7 @@ class Window(QtWidgets.QWidget):
 		self.startSCOCRButton.clicked.connect(self.start_ocr_worker)
 		self.pauseSCOCRButton.clicked.connect(self.pause_ocr_worker)
 		self.terminateSCOCRButton.clicked.connect(self.terminate_ocr_worker)
+		self.resetLayoutButton.clicked.connect(self.reset_ocr_layout)
 
 		grid = QtWidgets.QGridLayout()
 		grid.setHorizontalSpacing(10)
@@ -849,6 +870,8 @@ class Window(QtWidgets.QWidget):
 		grid.addWidget(self.startSCOCRButton, 1, 0)
 		grid.addWidget(self.pauseSCOCRButton, 1, 1)
 		grid.addWidget(self.terminateSCOCRButton, 1, 2)
+		grid.addWidget(self.chkPreview, 2, 0)
+		grid.addWidget(self.resetLayoutButton, 2, 1)
 
 		groupBox.setLayout(grid)
 		return groupBox
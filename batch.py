@@ -0,0 +1,176 @@
+# coding: utf8
+
+"""Offline OCR of a recorded game.
+
+Splits the video into segments, runs the OCR pipeline on each segment in a
+worker process and writes a timeline of the value changes, one row per group
+change with its frame number and time in the video.
+
+	python batch.py game.mp4 --settings settings.ini --out timeline.jsonl
+	python batch.py game.mp4 --coords coords.json --out timeline.csv --jobs 8
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from ocrpipeline import OcrCoordinate, OcrPipeline
+
+def segmentBounds(frameCount, segments):
+	"""Splits [0, frameCount) into up to segments contiguous [start, end) ranges.
+	The last range ends with the video (end None), containers often report a
+	frame count that is a little short; without a count the video is one range.
+	"""
+	if frameCount <= 0:
+		return [(0, None)]
+	segments = max(1, min(segments, frameCount))
+	bounds = [frameCount * i // segments for i in range(segments + 1)]
+	ranges = [(bounds[i], bounds[i + 1]) for i in range(segments) if bounds[i] < bounds[i + 1]]
+	ranges[-1] = (ranges[-1][0], None)
+	return ranges
+
+def workerInit():
+	# the pool already uses every core, OpenCV's own threads would only compete
+	cv2.setNumThreads(1)
+
+def openAt(path, frame):
+	"""Opens the video positioned at or before frame.
+	Returns the capture and the index of the next frame it reads: the position
+	is read back because a seek may land on another frame, e.g. a keyframe,
+	and one that lands past frame falls back to reading from the start.
+	"""
+	cam = cv2.VideoCapture(path)
+	if frame <= 0:
+		return cam, 0
+	cam.set(cv2.CAP_PROP_POS_FRAMES, frame)
+	position = int(cam.get(cv2.CAP_PROP_POS_FRAMES))
+	if 0 <= position <= frame:
+		return cam, position
+	logging.warning("seek to frame %u landed on %d, reading from the start instead", frame, position)
+	cam.release()
+	return cv2.VideoCapture(path), 0
+
+def processSegment(task):
+	"""Runs a fresh pipeline over frames [start, end) of the video, end None for the rest of it.
+	Decoding starts warmup frames early, so the digit layout and the held
+	values have settled by the time the segment begins.
+	Returns ([(frame, {name: value})], frames): the state at start and then
+	every change, and the index after the last frame read.
+	"""
+	path, start, end, warmup, step, coords, params = task
+	cam, frame = openAt(path, max(0, start - warmup))
+	pipeline = OcrPipeline(coords, params)
+
+	changes = []
+	last = None
+	img = None
+	while end is None or frame < end:
+		if not cam.grab():
+			break
+		frame += 1
+		index = frame - 1
+		# counted from the segment start, so its first frame is always decoded, it anchors the stitching
+		if (index - start) % step:
+			continue
+		success, img = cam.retrieve(img)
+		if not success:
+			break
+		pipeline.process_frame(img)
+		if index < start:
+			continue
+		readings = pipeline.readings()
+		if readings != last:
+			changes.append((index, readings))
+			last = readings
+	cam.release()
+	return changes, frame
+
+def stitchTimeline(segments, fps):
+	"""Joins the segment results into rows of (frame, seconds, group, value),
+	one per group whose value differs from the end state of the frames before it.
+	"""
+	rows = []
+	state = {}
+	for changes, frames in segments:
+		for frame, readings in changes:
+			for name, value in readings.items():
+				if name not in state or state[name] != value:
+					rows.append((frame, frame / fps if fps > 0 else 0.0, name, value))
+			state = readings
+	return rows
+
+def writeTimeline(rows, path):
+	if path.endswith(".csv"):
+		with open(path, "w", newline="") as f:
+			writer = csv.writer(f)
+			writer.writerow(["frame", "time", "group", "value"])
+			for frame, seconds, name, value in rows:
+				writer.writerow([frame, "{:.3f}".format(seconds), name, value])
+	else:
+		with open(path, "w") as f:
+			for frame, seconds, name, value in rows:
+				f.write(json.dumps({"frame": frame, "time": round(seconds, 3), "group": name, "value": value}) + "\n")
+
+def loadCoordinates(args):
+	if args.coords:
+		with open(args.coords) as f:
+			return [OcrCoordinate(name, coords) for name, coords in json.load(f).items()]
+	from ocrsettings import coordinatesFromSettings, loadSettings
+	return coordinatesFromSettings(loadSettings(args.settings))
+
+def loadParams(args):
+	from ocrsettings import loadSettings, paramsFromSettings
+	# segments already run on every core, group threads would only compete with them
+	return paramsFromSettings(loadSettings(args.settings), previewEnabled = False, sourceMinGroupHeight = 0, groupThreads = 1)
+
+def main():
+	parser = argparse.ArgumentParser(description = "Offline scoreboard OCR of a video file")
+	parser.add_argument("video")
+	parser.add_argument("--settings", default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.ini"), help = "settings.ini with the OCR parameters and, without --coords, the digit groups")
+	parser.add_argument("--coords", help = "JSON file of {group name: [x0, y0, x1, y1]}")
+	parser.add_argument("--out", default = "timeline.jsonl", help = "output file, .csv for CSV, anything else for JSON lines")
+	parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "worker processes")
+	parser.add_argument("--segments", type = int, default = 0, help = "video segments, 4 per job by default")
+	parser.add_argument("--warmup", type = int, default = 100, help = "frames decoded before each segment to settle the pipeline state")
+	parser.add_argument("--step", type = int, default = 1, help = "process every Nth frame")
+	args = parser.parse_args()
+
+	cam = cv2.VideoCapture(args.video)
+	if not cam.isOpened():
+		parser.error("cannot open {}".format(args.video))
+	frameCount = int(cam.get(cv2.CAP_PROP_FRAME_COUNT))
+	fps = cam.get(cv2.CAP_PROP_FPS)
+	cam.release()
+	if frameCount <= 0:
+		logging.warning("%s reports no frame count, reading it in one segment", args.video)
+
+	coords = loadCoordinates(args)
+	if not coords:
+		parser.error("no digit groups, pass --coords or a settings.ini with saved coordinates")
+	params = loadParams(args)
+	bounds = segmentBounds(frameCount, args.segments or args.jobs * 4)
+	tasks = [(args.video, start, end, args.warmup, max(1, args.step), coords, params) for start, end in bounds]
+	logging.info("%d frames at %.2f fps in %u segments on %u processes", frameCount, fps, len(tasks), args.jobs)
+
+	started = time.monotonic()
+	with ProcessPoolExecutor(max_workers = args.jobs, initializer = workerInit) as pool:
+		segments = list(pool.map(processSegment, tasks))
+	frameCount = segments[-1][1]
+	if frameCount == 0:
+		parser.error("no frames could be read from {}".format(args.video))
+	rows = stitchTimeline(segments, fps)
+	writeTimeline(rows, args.out)
+
+	elapsed = time.monotonic() - started
+	print("{} frames in {:.1f} s ({:.0f} fps), {} changes written to {}".format(frameCount, elapsed, frameCount / elapsed if elapsed > 0 else 0, len(rows), args.out))
+
+if __name__ == '__main__':
+	logging.basicConfig(level = logging.INFO)
+	main()
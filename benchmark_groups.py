@@ -0,0 +1,92 @@
+# coding: utf8
+
+"""Digit group scaling benchmark for OcrPipeline.process_frame.
+
+Draws a synthetic scoreboard with N seven-segment groups of three digits and
+times the pipeline on it with different groupThreads settings. Change
+detection is off, so every group is processed on every frame.
+
+	python benchmark_groups.py --groups 2,4,8,16,32 --threads 1,2,4,8
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy
+
+from ocrpipeline import OcrCoordinate, OcrPipeline, ScOcrWorkerParams
+
+SEGMENTS = {'a': (0.1, 0, 0.9, 0.15), 'b': (0.8, 0.05, 1, 0.45), 'c': (0.8, 0.55, 1, 0.95), 'd': (0.1, 0.85, 0.9, 1), 'e': (0, 0.55, 0.2, 0.95), 'f': (0, 0.05, 0.2, 0.45), 'g': (0.1, 0.43, 0.9, 0.57)}
+DIGITS = ('abcdef', 'bc', 'abdeg', 'abcdg', 'bcfg', 'acdfg', 'acdefg', 'abc', 'abcdefg', 'abcdfg')
+DIGIT_WIDTH = 40
+DIGIT_HEIGHT = 70
+GROUP_DIGITS = 3
+
+def groupLayout(count, width, height):
+	"""Group rectangles [x0, y0, x1, y1] on a grid that fills the frame."""
+	columns = max(1, width // (GROUP_DIGITS * 60 + 40))
+	rects = []
+	for i in range(count):
+		x = 20 + (i % columns) * (GROUP_DIGITS * 60 + 40)
+		y = 20 + (i // columns) * (DIGIT_HEIGHT + 40)
+		if y + DIGIT_HEIGHT + 20 > height:
+			raise ValueError("{} groups do not fit in {}x{}".format(count, width, height))
+		rects.append([x - 10, y - 10, x + GROUP_DIGITS * 60, y + DIGIT_HEIGHT + 10])
+	return rects
+
+def drawFrame(rects, values, width, height):
+	img = numpy.full((height, width, 3), 20, numpy.uint8)
+	for rect, value in zip(rects, values):
+		for i, digit in enumerate(value):
+			x = rect[0] + 10 + i * 60
+			y = rect[1] + 10
+			for segment in DIGITS[int(digit)]:
+				x0, y0, x1, y1 = SEGMENTS[segment]
+				cv2.rectangle(img, (int(x + x0 * DIGIT_WIDTH), int(y + y0 * DIGIT_HEIGHT)), (int(x + x1 * DIGIT_WIDTH) - 1, int(y + y1 * DIGIT_HEIGHT) - 1), (40, 60, 250), -1)
+	return img
+
+def benchmarkParams(threads, roiOnly):
+	return ScOcrWorkerParams(0, "", 0, 0, 0, 1, 1, 127, 0, 0, False, [0, 0, 0, 0], roiOnly = roiOnly, changeTolerance = None, previewEnabled = False, groupThreads = threads)
+
+def measure(frames, rects, threads, roiOnly, repeat):
+	"""Mean process_frame seconds, and the readings of the last frame."""
+	coords = [OcrCoordinate("group{}".format(i), rect) for i, rect in enumerate(rects)]
+	pipeline = OcrPipeline(coords, benchmarkParams(threads, roiOnly))
+	for img in frames:
+		pipeline.process_frame(img)
+
+	start = time.perf_counter()
+	for i in range(repeat):
+		pipeline.process_frame(frames[i % len(frames)])
+	elapsed = time.perf_counter() - start
+	readings = pipeline.readings()
+	pipeline.close()
+	return elapsed / repeat, readings
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "digit group scaling benchmark")
+	parser.add_argument("--groups", default = "2,4,8,16,32", help = "comma separated group counts")
+	parser.add_argument("--threads", default = "1,2,4,8", help = "comma separated groupThreads values")
+	parser.add_argument("--frames", type = int, default = 200, help = "frames timed per measurement")
+	parser.add_argument("--size", default = "1920x1080", help = "frame size")
+	parser.add_argument("--full-frame", action = "store_true", help = "binarize the whole frame instead of the group rectangles")
+	args = parser.parse_args()
+
+	width, height = (int(n) for n in args.size.split("x"))
+	threadCounts = [int(n) for n in args.threads.split(",")]
+	print("{} cores, OpenCV threads {}".format(cv2.getNumberOfCPUs(), cv2.getNumThreads()))
+	print("{:>8}".format("groups") + "".join("{:>14}".format("{} thr ms".format(n)) for n in threadCounts) + "{:>10}".format("speedup"))
+	for count in [int(n) for n in args.groups.split(",")]:
+		rects = groupLayout(count, width, height)
+		frames = [drawFrame(rects, ["{:03d}".format((i * 7 + f * 111) % 1000) for i in range(count)], width, height) for f in range(4)]
+		times = []
+		expected = None
+		for threads in threadCounts:
+			seconds, readings = measure(frames, rects, threads, not args.full_frame, args.frames)
+			# every thread count has to read the same values
+			if expected is not None and readings != expected:
+				raise RuntimeError("{} groups read differently with {} threads".format(count, threads))
+			expected = readings
+			times.append(seconds)
+		print("{:>8}".format(count) + "".join("{:>14.2f}".format(t * 1e3) for t in times) + "{:>10.2f}".format(times[0] / min(times)))
@@ -0,0 +1,42 @@
+# coding: utf8
+
+"""Compares the JSON result messages with the binary packResult format:
+message size and encode/decode time for a typical delta and a full snapshot.
+
+	python benchmark_wire.py --repeat 100000
+"""
+
+import argparse
+import json
+import time
+import timeit
+
+from publisher import packResult, resultMessage, unpackResult, wallClock
+
+SNAPSHOT = {"clock": "1159", "shot_clock": "24", "home_score": "87", "guest_score": "85", "quarter": "4", "home_fouls": "3", "guest_fouls": "5"}
+DELTA = {"clock": "1158"}
+
+def measure(label, values, repeat):
+	captured = time.monotonic()
+	timestamp = wallClock()
+	encodeJson = lambda: json.dumps(resultMessage("delta", 1234, values, timestamp, 1233)).encode('utf8')
+	encodeBinary = lambda: packResult("delta", 1234, values, captured, 1233)
+	jsonData = encodeJson()
+	binaryData = encodeBinary()
+	assert unpackResult(binaryData)[4] == values
+
+	rows = [
+		("json", len(jsonData), timeit.timeit(encodeJson, number = repeat), timeit.timeit(lambda: json.loads(jsonData), number = repeat)),
+		("binary", len(binaryData), timeit.timeit(encodeBinary, number = repeat), timeit.timeit(lambda: unpackResult(binaryData), number = repeat))
+	]
+	for name, size, encode, decode in rows:
+		print("{:<10} {:<8} {:>8} {:>14.2f} {:>14.2f}".format(label, name, size, encode / repeat * 1e6, decode / repeat * 1e6))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "result wire format benchmark")
+	parser.add_argument("--repeat", type = int, default = 100000)
+	args = parser.parse_args()
+
+	print("{:<10} {:<8} {:>8} {:>14} {:>14}".format("message", "format", "bytes", "encode us", "decode us"))
+	measure("delta", DELTA, args.repeat)
+	measure("snapshot", SNAPSHOT, args.repeat)
@@ -0,0 +1,106 @@
+# coding: utf8
+
+"""Fan-out benchmark for the WebSocket broadcaster.
+
+Connects N local clients to a BroadcastServerFactory and pushes deltas through
+it, once framed per client like the old broadcast did and once as a prepared
+message shared by all clients. Reports the server-side fan-out time per update
+and the delivered message rate.
+
+	python benchmark_ws.py --clients 1,10,50,100,200,400 --updates 200
+"""
+
+import argparse
+import json
+import time
+
+from autobahn.twisted.websocket import WebSocketClientProtocol, WebSocketClientFactory, connectWS, listenWS
+from twisted.internet import defer, reactor, task
+
+from publisher import resultMessage, wallClock
+from wsworker import WebSocketsWorker
+
+class CountingClient(WebSocketClientProtocol):
+	def onOpen(self):
+		self.received = 0
+		self.factory.opened.append(self)
+		if len(self.factory.opened) == self.factory.expected:
+			self.factory.allOpen.callback(None)
+
+	def onMessage(self, payload, isBinary):
+		self.received += 1
+		if json.loads(payload)["seq"] == self.factory.lastSeq:
+			self.factory.done += 1
+			if self.factory.done == self.factory.expected:
+				self.factory.allDone.callback(None)
+
+class QuietServerFactory(WebSocketsWorker.BroadcastServerFactory):
+	def register(self, client):
+		self.clients.add(client)
+
+	def unregister(self, client):
+		self.clients.discard(client)
+
+def perClientPublish(server, seq, changes, timestamp, captured, payload):
+	"""The broadcast before prepared messages: every client frames the payload itself."""
+	for c in list(server.clients):
+		c.sendMessage(payload)
+
+def preparedPublish(server, seq, changes, timestamp, captured, payload):
+	server.publish_delta(seq, changes, timestamp, captured, payload)
+
+@defer.inlineCallbacks
+def runRound(server, url, clients, updates, publish):
+	client = WebSocketClientFactory(url)
+	client.protocol = CountingClient
+	client.expected = clients
+	client.opened = []
+	client.done = 0
+	client.allOpen = defer.Deferred()
+	client.allDone = defer.Deferred()
+	client.lastSeq = server.seq + updates
+	for i in range(clients):
+		connectWS(client)
+	yield client.allOpen
+
+	fanout = 0.0
+	start = time.perf_counter()
+	for i in range(updates):
+		seq = server.seq + 1
+		changes = {"clock": str(i % 100), "score": str(i // 10)}
+		timestamp = wallClock()
+		payload = json.dumps(resultMessage("delta", seq, changes, timestamp, seq - 1)).encode('utf8')
+		t = time.perf_counter()
+		publish(server, seq, changes, timestamp, time.monotonic(), payload)
+		fanout += time.perf_counter() - t
+		server.seq = seq
+		# let the reactor write between updates, like frames arriving from the OCR thread
+		yield task.deferLater(reactor, 0, lambda: None)
+	yield client.allDone
+	elapsed = time.perf_counter() - start
+
+	for c in client.opened:
+		c.dropConnection(abort=True)
+	while server.clients:
+		yield task.deferLater(reactor, 0.01, lambda: None)
+	return fanout / updates, clients * updates / elapsed
+
+@defer.inlineCallbacks
+def main(reactor, args):
+	url = "ws://127.0.0.1:{}".format(args.port)
+	server = QuietServerFactory(url, maxLag=3600)
+	server.protocol = WebSocketsWorker.BroadcastServerProtocol
+	listenWS(server)
+
+	print("{:>8} {:>22} {:>22} {:>14} {:>14}".format("clients", "per-client us/update", "prepared us/update", "per-client msg/s", "prepared msg/s"))
+	for clients in [int(n) for n in args.clients.split(",")]:
+		perClient, perClientRate = yield runRound(server, url, clients, args.updates, perClientPublish)
+		prepared, preparedRate = yield runRound(server, url, clients, args.updates, preparedPublish)
+		print("{:>8} {:>22.1f} {:>22.1f} {:>14.0f} {:>14.0f}".format(clients, perClient * 1e6, prepared * 1e6, perClientRate, preparedRate))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "WebSocket fan-out benchmark")
+	parser.add_argument("--clients", default = "1,10,50,100,200,400", help = "comma separated client counts")
+	parser.add_argument("--updates", type = int, default = 200, help = "deltas per round")
+	parser.add_argument("--port", type = int, default = 9100)
+	task.react(main, [parser.parse_args()])
@@ -0,0 +1,218 @@
+# coding: utf8
+
+import logging
+
+import threading
+import time
+
+class Frame():
+	"""One captured image with its ring buffer slot and monotonic capture time."""
+	def __init__(self, image, slot, index, timestamp):
+		self.image = image
+		self.slot = slot
+		self.index = index # sequence number of the frame since capture start
+		self.timestamp = timestamp # time.monotonic() right after the driver returned the frame
+
+class FrameRingBuffer():
+	"""Small preallocated ring of frame buffers that always hands out the newest frame.
+	The writer fills a slot nobody is reading and publishes it; a published frame
+	that is replaced before the reader took it counts as dropped.
+	"""
+	def __init__(self, size = 3):
+		if size < 3:
+			raise ValueError("the ring needs at least 3 slots, got {}".format(size))
+		self.size = size
+		self.buffers = [None] * size
+		self.timestamps = [0.0] * size
+		self.indexes = [0] * size
+
+		self.latest = -1 # slot of the newest published frame
+		self.reading = -1 # slot currently held by the reader
+		self.consumed = -1 # index of the last frame handed to the reader
+		self.published = -1 # index of the newest published frame
+		self.finished = False
+
+		self.frames_captured = 0
+		self.frames_dropped = 0
+
+		self._lock = threading.Condition()
+
+	def write_slot(self):
+		"""Returns the slot the writer may fill next: neither the newest frame nor the one being read."""
+		with self._lock:
+			slot = (self.latest + 1) % self.size
+			while slot == self.latest or slot == self.reading:
+				slot = (slot + 1) % self.size
+			return slot
+
+	def publish(self, slot, image, timestamp):
+		with self._lock:
+			self.buffers[slot] = image
+			self.timestamps[slot] = timestamp
+			if self.published > self.consumed:
+				self.frames_dropped += 1
+			self.published += 1
+			self.indexes[slot] = self.published
+			self.latest = slot
+			self.frames_captured += 1
+			self._lock.notify_all()
+
+	def finish(self):
+		with self._lock:
+			self.finished = True
+			self._lock.notify_all()
+
+	def acquire(self, timeout = None):
+		"""Waits for a frame newer than the last one handed out and holds its slot.
+		Returns None on timeout or once the writer finished.
+		"""
+		with self._lock:
+			if not self._lock.wait_for(lambda: self.published > self.consumed or self.finished, timeout):
+				return None
+			if self.published <= self.consumed:
+				return None
+			self.reading = self.latest
+			self.consumed = self.published
+			return Frame(self.buffers[self.latest], self.latest, self.published, self.timestamps[self.latest])
+
+	def release(self, frame):
+		with self._lock:
+			if self.reading == frame.slot:
+				self.reading = -1
+
+class CaptureThread(threading.Thread):
+	"""Reads frames from a cv2.VideoCapture into a FrameRingBuffer as fast as they arrive,
+	so the driver queue never fills up with stale frames while a frame is processed.
+	Every frame is grabbed, but only the ones that pass the decimation and the
+	target rate are decoded with retrieve(). With a FrameScheduler, frames that a
+	newer one replaces before the processing loop is due are not decoded either.
+	While paused, live sources are still
+	grabbed so the driver queue stays fresh but nothing is decoded, and paced
+	sources are not read at all.
+	"""
+	def __init__(self, cam, ring, fps = 0, decimation = 1, targetFps = 0, scheduler = None):
+		threading.Thread.__init__(self, name = "capture", daemon = True)
+		self.cam = cam
+		self.ring = ring
+		self.fps = fps # pace reads for file sources, 0 for live sources
+		self.scheduler = scheduler # FrameScheduler of the processing loop
+		self.grab_interval = 0.0 # smoothed seconds between grabs
+		self.frames_grabbed = 0
+		self.frames_skipped = 0 # grabbed but never decoded
+		self.next_retrieve = 0.0
+		self.set_rate(decimation, targetFps)
+		self._isRunning = True
+		self._paused = False
+		self._pause = threading.Condition()
+
+	def set_rate(self, decimation = 1, targetFps = 0):
+		self.decimation = max(1, int(decimation))
+		self.retrieve_interval = 1.0 / targetFps if targetFps > 0 else 0
+
+	def stop(self):
+		with self._pause:
+			self._isRunning = False
+			self._pause.notify_all()
+
+	def set_paused(self, paused):
+		with self._pause:
+			self._paused = paused
+			self._pause.notify_all()
+
+	def wanted(self, now):
+		"""Decides whether the frame grabbed last is decoded."""
+		if self.decimation > 1 and (self.frames_grabbed - 1) % self.decimation:
+			return False
+		# a newer frame is expected before the processing loop takes the next one
+		due = self.scheduler.due() if self.scheduler is not None else None
+		if due is not None and now + 1.5 * self.grab_interval < due:
+			return False
+		if self.retrieve_interval:
+			if now < self.next_retrieve:
+				return False
+			self.next_retrieve = max(self.next_retrieve + self.retrieve_interval, now - self.retrieve_interval)
+		return True
+
+	def run(self):
+		interval = 1.0 / self.fps if self.fps > 0 else 0
+		next_read = time.monotonic()
+		last_grab = None
+		try:
+			while self._isRunning:
+				if self._paused and interval:
+					with self._pause:
+						self._pause.wait_for(lambda: not self._paused or not self._isRunning)
+					next_read = time.monotonic()
+					continue
+
+				if interval:
+					delay = next_read - time.monotonic()
+					if delay > 0:
+						time.sleep(delay)
+					next_read = max(next_read + interval, time.monotonic() - interval)
+
+				if not self.cam.grab():
+					logging.info("Capture ended after %u frames", self.frames_grabbed)
+					break
+				timestamp = time.monotonic()
+				self.frames_grabbed += 1
+				if last_grab is not None:
+					self.grab_interval = (timestamp - last_grab) if not self.grab_interval else 0.8 * self.grab_interval + 0.2 * (timestamp - last_grab)
+				last_grab = timestamp
+				if self._paused or not self.wanted(timestamp):
+					self.frames_skipped += 1
+					continue
+
+				slot = self.ring.write_slot()
+				success, image = self.cam.retrieve(self.ring.buffers[slot])
+				if not success:
+					logging.info("Capture ended after %u frames", self.frames_grabbed)
+					break
+				self.ring.publish(slot, image, timestamp)
+		except Exception as e:
+			logging.exception(e)
+		finally:
+			self.ring.finish()
+
+class FrameScheduler():
+	"""Paces a processing loop to a target period.
+	Only the part of the period not already spent on the frame is slept, and a
+	late frame restarts the schedule instead of bursting to catch up.
+	"""
+	def __init__(self):
+		self.next_frame = None
+		self.interval = 0.0 # period of the last wait()
+		self.frames_late = 0
+		self._wake = threading.Condition()
+		self._woken = False
+
+	def wait(self, interval):
+		"""Sleeps until interval seconds after the previous frame started; 0 does not sleep."""
+		now = time.monotonic()
+		self.interval = max(0.0, interval)
+		if interval <= 0:
+			self.next_frame = now
+			return
+
+		if self.next_frame is None or now - self.next_frame > interval:
+			if self.next_frame is not None:
+				self.frames_late += 1
+			self.next_frame = now
+		else:
+			self.next_frame += interval
+			with self._wake:
+				self._wake.wait_for(lambda: self._woken, self.next_frame - now)
+				self._woken = False
+
+	def due(self):
+		"""Monotonic time the next frame is processed at the earliest, None before the first wait()."""
+		next_frame = self.next_frame
+		if next_frame is None:
+			return None
+		return next_frame + self.interval
+
+	def wake(self):
+		"""Interrupts a pending wait, e.g. when the loop is stopped."""
+		with self._wake:
+			self._woken = True
+			self._wake.notify_all()
@@ -0,0 +1,4 @@
+# coding: utf8
+
+# opencv_test.py is an interactive webcam script, not a test module
+collect_ignore = ["opencv_test.py"]
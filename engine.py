@@ -0,0 +1,272 @@
+# coding: utf8
+
+"""Headless multi-camera engine.
+
+Runs one capture+OCR pipeline per camera, each in its own process with its own
+settings.ini (coordinates and OCR parameters as saved by the GUI), behind one
+shared WebSocket and HTTP front end. Group names are prefixed with the camera
+name, e.g. "main/clock_1" and "shot1/shot_clock_1", so clients subscribe to
+one camera with the pattern "main/*".
+
+	python engine.py main=arena/main.ini shot1=arena/shot1.ini shot2=arena/shot2.ini
+
+/cameras.json reports the state and the OCR metrics of every pipeline.
+Pipelines that exit are restarted, with a growing delay while they keep failing.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from autobahn.twisted.websocket import listenWS
+from twisted.internet import reactor, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from metrics import METRICS
+from ocrrunner import OcrRunner
+from publisher import OcrResult, ResultDelta
+# the pipeline processes import this module again and must stay free of Qt:
+# wsworker and ocrsettings are imported where the engine process uses them
+
+METRICS_INTERVAL = 5.0 # seconds between the metrics snapshots a pipeline sends
+STABLE_RUN = 60.0 # seconds a pipeline has to run before its restart delay resets
+MAX_RESTART_DELAY = 30.0
+
+def runCamera(name, coords, params, results):
+	"""Process entry of one pipeline: runs an OcrRunner on this process's main
+	thread and sends ("result", name, groups, timestamp, index) whenever a value
+	changed, and ("metrics", name, snapshot) every METRICS_INTERVAL.
+	SIGTERM stops the runner.
+	"""
+	# Ctrl-C reaches the whole process group, the engine stops its pipelines itself
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	# no multiprocessing.Event: setting one blocks for good once a process died waiting on it
+	stop = threading.Event()
+	signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+	logging.basicConfig(level = logging.INFO, format = "%(asctime)s " + name + " %(levelname)s %(message)s")
+
+	runner = OcrRunner(coords, params)
+
+	# unchanged frames stay in this process, only changes cross the pipe
+	delta = ResultDelta()
+	prefix = name + "/"
+	def send(result):
+		if delta.update(result) is not None:
+			results.put(("result", name, [(prefix + groupName, value) for groupName, value in result.groups], result.timestamp, result.index))
+	runner.publisher.subscribe(send)
+
+	finished = threading.Event()
+	def watch():
+		while not stop.wait(METRICS_INTERVAL):
+			results.put(("metrics", name, METRICS.snapshot()))
+		# a stop that lands before run() started is overwritten by it, so repeat it
+		while not finished.is_set():
+			runner.stop()
+			finished.wait(0.5)
+	threading.Thread(target = watch, name = "engine-watch", daemon = True).start()
+
+	try:
+		runner.run()
+	finally:
+		finished.set()
+
+class CameraProcess():
+	"""One supervised pipeline process. The settings are read once by the
+	engine, the process gets the plain coordinates and parameters.
+	"""
+	def __init__(self, name, settings, coords, params):
+		self.name = name
+		self.settings = settings
+		self.coords = coords # OcrCoordinate list
+		self.params = params # ScOcrWorkerParams
+		self.process = None
+		self.started_at = None
+		self.failures = 0 # exits in a row without a STABLE_RUN
+		self.restart_at = None # monotonic time of the next start after an exit
+		self.last_result = None
+		self.metrics = None
+
+	def start(self, context, results):
+		self.process = context.Process(target = runCamera, args = (self.name, self.coords, self.params, results), name = "camera-" + self.name)
+		self.process.start()
+		self.started_at = time.monotonic()
+		self.restart_at = None
+		logging.info("started camera %s (pid %u) with %s", self.name, self.process.pid, self.settings)
+
+	def alive(self):
+		return self.process is not None and self.process.is_alive()
+
+	def stop(self, timeout = 3.0):
+		if not self.alive():
+			return
+		self.process.join(timeout)
+		if self.process.is_alive():
+			logging.warning("camera %s did not stop, killing it", self.name)
+			self.process.kill()
+			self.process.join()
+
+	def status(self, now):
+		return {
+			"name": self.name,
+			"settings": self.settings,
+			"pid": self.process.pid if self.process is not None else None,
+			"alive": self.alive(),
+			"exitcode": self.process.exitcode if self.process is not None else None,
+			"failures": self.failures,
+			"uptime": now - self.started_at if self.alive() else 0.0,
+			"last_result": now - self.last_result if self.last_result is not None else None,
+			"metrics": self.metrics
+		}
+
+class CamerasResource(Resource):
+	"""Serves the state of every pipeline process as JSON."""
+	isLeaf = True
+
+	def __init__(self, engine):
+		Resource.__init__(self)
+		self.engine = engine
+
+	def render_GET(self, request):
+		request.setHeader(b"content-type", b"application/json")
+		now = time.monotonic()
+		return json.dumps([camera.status(now) for camera in self.engine.cameras]).encode('utf8')
+
+class Engine():
+	"""Supervises the pipeline processes and merges their results into one stream.
+	The receiver thread owns the merged state and hands the deltas to the
+	WebSocketsWorker, whose factory broadcasts them on the reactor thread.
+	"""
+	def __init__(self, cameras, serverAddress, httpPort = 8080, maxLag = 5.0):
+		self.cameras = cameras
+		self.http_port = httpPort
+		self.context = multiprocessing.get_context("spawn") # no fork of a process with Qt and reactor threads
+		self.results = self.context.Queue()
+		from wsworker import WebSocketsWorker
+		self.ws = WebSocketsWorker(serverAddress = serverAddress, maxLag = maxLag)
+		self.groups = {} # camera name: [(namespaced group name, value)] of its last result, only touched by the receiver
+		self.receiver = threading.Thread(target = self.receive, name = "engine-receive", daemon = True)
+		self.supervisor = task.LoopingCall(self.supervise)
+		self.stopping = False
+
+	def camera(self, name):
+		for camera in self.cameras:
+			if camera.name == name:
+				return camera
+		return None
+
+	def start(self):
+		from wsworker import WebSocketsWorker, webRoot
+		self.ws.factory.protocol = WebSocketsWorker.BroadcastServerProtocol
+		listenWS(self.ws.factory)
+		webdir = webRoot(self.ws.factory)
+		webdir.putChild(b'cameras.json', CamerasResource(self))
+		reactor.listenTCP(self.http_port, Site(webdir))
+
+		self.receiver.start()
+		for camera in self.cameras:
+			camera.start(self.context, self.results)
+		self.supervisor.start(1.0, now = False)
+		reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+	def stop(self):
+		self.stopping = True
+		if self.supervisor.running:
+			self.supervisor.stop()
+		# all of them stop at once, then each gets its own timeout
+		for camera in self.cameras:
+			if camera.alive():
+				camera.process.terminate()
+		for camera in self.cameras:
+			camera.stop()
+		self.results.put(None)
+		self.receiver.join(1.0)
+
+	def receive(self):
+		while True:
+			message = self.results.get()
+			if message is None:
+				break
+			try:
+				self.handle(message)
+			except Exception as e:
+				logging.exception(e)
+
+	def handle(self, message):
+		kind, name = message[0], message[1]
+		camera = self.camera(name)
+		if camera is None:
+			return
+		if kind == "metrics":
+			camera.metrics = message[2]
+			return
+		groups, timestamp, index = message[2:]
+		self.groups[name] = groups
+		if groups:
+			camera.last_result = time.monotonic()
+		merged = [group for c in self.cameras for group in self.groups.get(c.name, ())]
+		self.ws.publish_result(OcrResult(merged, timestamp, index))
+
+	def supervise(self):
+		now = time.monotonic()
+		for camera in self.cameras:
+			if self.stopping or camera.alive():
+				continue
+			if camera.restart_at is None:
+				# the values of a stopped camera are removed, not left frozen
+				self.results.put(("result", camera.name, [], now, 0))
+				camera.failures = 0 if now - camera.started_at >= STABLE_RUN else camera.failures + 1
+				delay = min(MAX_RESTART_DELAY, 2 ** camera.failures - 1)
+				camera.restart_at = now + delay
+				logging.warning("camera %s exited with code %s, restarting in %.0f s", camera.name, camera.process.exitcode, delay)
+				METRICS.increment("camera_restarts")
+			if now >= camera.restart_at:
+				camera.start(self.context, self.results)
+
+def parseCameras(specs):
+	"""CameraProcess per "name=settings.ini" argument, in the given order."""
+	from ocrsettings import coordinatesFromSettings, loadSettings, paramsFromSettings
+
+	cameras = []
+	for spec in specs:
+		name, sep, settings = spec.partition("=")
+		if not sep or not name or not settings:
+			raise ValueError("expected name=settings.ini, got {!r}".format(spec))
+		if "/" in name or any(c in name for c in "*?["):
+			raise ValueError("camera name {!r} must not contain / or glob characters".format(name))
+		if any(camera.name == name for camera in cameras):
+			raise ValueError("camera {!r} given twice".format(name))
+		if not os.path.isfile(settings):
+			raise ValueError("no settings file {!r}".format(settings))
+		qsettings = loadSettings(settings)
+		coords = coordinatesFromSettings(qsettings)
+		if not coords:
+			raise ValueError("no digit groups in {!r}".format(settings))
+		cameras.append(CameraProcess(name, settings, coords, paramsFromSettings(qsettings, previewEnabled = False)))
+	return cameras
+
+def main():
+	parser = argparse.ArgumentParser(description = "Multi-camera scoreboard OCR engine")
+	parser.add_argument("cameras", nargs = "+", metavar = "name=settings.ini", help = "camera name and the settings.ini with its source, coordinates and OCR parameters")
+	parser.add_argument("--ws", default = "ws://0.0.0.0:9000", help = "WebSocket address")
+	parser.add_argument("--http-port", type = int, default = 8080)
+	parser.add_argument("--max-lag", type = float, default = 5.0, help = "seconds a WebSocket client may stay backed up")
+	args = parser.parse_args()
+
+	try:
+		cameras = parseCameras(args.cameras)
+	except ValueError as e:
+		parser.error(str(e))
+
+	engine = Engine(cameras, args.ws, args.http_port, args.max_lag)
+	engine.start()
+	reactor.run()
+
+if __name__ == '__main__':
+	logging.basicConfig(level = logging.INFO)
+	main()
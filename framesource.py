@@ -0,0 +1,233 @@
+# coding: utf8
+
+import glob
+import logging
+import os
+
+import cv2
+import numpy
+
+DEFAULT_SOURCE = 'test_images/test_video.mp4'
+
+#capture modes tried when the resolution follows the digit sizes, smallest first
+SOURCE_MODES = ((320, 180), (424, 240), (640, 360), (848, 480), (960, 540), (1280, 720), (1600, 900), (1920, 1080))
+
+class FrameSource():
+	"""cv2.VideoCapture-like frame source with the capture format applied on open.
+	The CaptureThread only uses grab, retrieve, get, isOpened and release.
+	"""
+	live = True # delivers frames at its own rate, recorded sources are paced at their native fps
+
+	def __init__(self, fourcc = "", width = 0, height = 0, fps = 0, bufferSize = 0):
+		self.fourcc = fourcc # e.g. "MJPG" or "YUYV", empty for the driver default
+		self.width = int(width) # 0 keeps the driver default
+		self.height = int(height)
+		self.fps = float(fps)
+		self.bufferSize = int(bufferSize) # driver queue depth, 0 keeps the default
+		self.cam = None
+
+	def create_capture(self):
+		raise NotImplementedError
+
+	def open(self):
+		self.cam = self.create_capture()
+		if self.cam.isOpened():
+			self.configure()
+			logging.info("Opened %s: %ux%u %s at %.1f fps", self.describe(), self.get(cv2.CAP_PROP_FRAME_WIDTH), self.get(cv2.CAP_PROP_FRAME_HEIGHT), fourccText(self.get(cv2.CAP_PROP_FOURCC)), self.get(cv2.CAP_PROP_FPS))
+		else:
+			logging.error("Could not open %s", self.describe())
+		return self.cam.isOpened()
+
+	def configure(self):
+		# most V4L2 drivers only offer the larger modes once the FOURCC is set, so it goes first
+		if self.fourcc:
+			self.cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+		if self.width > 0 and self.height > 0:
+			self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+			self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+		if self.fps > 0:
+			self.cam.set(cv2.CAP_PROP_FPS, self.fps)
+		if self.bufferSize > 0:
+			self.cam.set(cv2.CAP_PROP_BUFFERSIZE, self.bufferSize)
+
+	def describe(self):
+		return type(self).__name__
+
+	def pace_fps(self):
+		"""Rate the CaptureThread reads at, 0 for live sources."""
+		if self.live:
+			return 0
+		return self.fps if self.fps > 0 else self.get(cv2.CAP_PROP_FPS)
+
+	def grab(self):
+		return self.cam.grab()
+
+	def retrieve(self, image = None):
+		return self.cam.retrieve(image)
+
+	def read(self, image = None):
+		return self.cam.read(image)
+
+	def get(self, prop):
+		return self.cam.get(prop)
+
+	def isOpened(self):
+		return self.cam is not None and self.cam.isOpened()
+
+	def release(self):
+		if self.cam is not None:
+			self.cam.release()
+
+class DeviceSource(FrameSource):
+	"""Local camera or capture card by device index."""
+	def __init__(self, index, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.index = int(index)
+
+	def create_capture(self):
+		return cv2.VideoCapture(self.index)
+
+	def describe(self):
+		return "device {}".format(self.index)
+
+class StreamSource(FrameSource):
+	"""Network stream such as RTSP; format and resolution are chosen by the sender,
+	only the buffer depth applies.
+	"""
+	def __init__(self, url, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.url = url
+
+	def create_capture(self):
+		return cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
+
+	def configure(self):
+		if self.bufferSize > 0:
+			self.cam.set(cv2.CAP_PROP_BUFFERSIZE, self.bufferSize)
+
+	def describe(self):
+		return "stream {}".format(self.url)
+
+class FileSource(FrameSource):
+	"""Recorded video, played at its native rate unless fps is set."""
+	live = False
+
+	def __init__(self, path, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.path = path
+
+	def create_capture(self):
+		return cv2.VideoCapture(self.path)
+
+	def configure(self):
+		pass
+
+	def describe(self):
+		return "file {}".format(self.path)
+
+class ImageSequence():
+	"""Minimal VideoCapture stand-in over a sorted list of image files."""
+	def __init__(self, files, fps):
+		self.files = files
+		self.fps = fps
+		self.position = -1
+		self.shape = None
+		if files:
+			image = cv2.imread(files[0])
+			self.shape = image.shape if image is not None else None
+
+	def isOpened(self):
+		return self.shape is not None
+
+	def grab(self):
+		self.position += 1
+		return 0 <= self.position < len(self.files)
+
+	def retrieve(self, image = None):
+		if not 0 <= self.position < len(self.files):
+			return False, None
+		decoded = cv2.imread(self.files[self.position])
+		if decoded is None:
+			return False, None
+		if image is not None and image.shape == decoded.shape:
+			numpy.copyto(image, decoded)
+			return True, image
+		return True, decoded
+
+	def read(self, image = None):
+		if not self.grab():
+			return False, None
+		return self.retrieve(image)
+
+	def get(self, prop):
+		if prop == cv2.CAP_PROP_FPS:
+			return self.fps
+		if prop == cv2.CAP_PROP_FRAME_COUNT:
+			return len(self.files)
+		if prop == cv2.CAP_PROP_FRAME_WIDTH and self.shape is not None:
+			return self.shape[1]
+		if prop == cv2.CAP_PROP_FRAME_HEIGHT and self.shape is not None:
+			return self.shape[0]
+		return 0
+
+	def set(self, prop, value):
+		return False
+
+	def release(self):
+		self.position = len(self.files)
+
+class ImageSequenceSource(FrameSource):
+	"""Still images from a directory or a glob pattern, in file name order, at fps (25 by default)."""
+	live = False
+
+	def __init__(self, pattern, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.pattern = pattern
+
+	def create_capture(self):
+		pattern = os.path.join(self.pattern, '*') if os.path.isdir(self.pattern) else self.pattern
+		files = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+		return ImageSequence(files, self.fps if self.fps > 0 else 25.0)
+
+	def configure(self):
+		pass
+
+	def describe(self):
+		return "image sequence {}".format(self.pattern)
+
+def fourccText(code):
+	code = int(code)
+	return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\0")
+
+def frameSource(spec, **kwargs):
+	"""Creates the source for a videoCaptureIndex setting: a device index, a URL,
+	an image directory or glob pattern, or a video file; None or empty plays the test video.
+	The setting comes in as text, so "1" opens device 1 and not a file named 1.
+	"""
+	spec = "" if spec is None else str(spec).strip()
+	if spec == "":
+		return FileSource(DEFAULT_SOURCE, **kwargs)
+	if spec.isdigit():
+		return DeviceSource(int(spec), **kwargs)
+	if "://" in spec:
+		return StreamSource(spec, **kwargs)
+	if os.path.isdir(spec) or any(c in spec for c in "*?["):
+		return ImageSequenceSource(spec, **kwargs)
+	return FileSource(spec, **kwargs)
+
+def roiSourceSize(frameSize, rects, minGroupHeight, modes = SOURCE_MODES):
+	"""Smallest capture mode, up to frameSize, in which every digit group rectangle
+	(in frameSize pixels) is still at least minGroupHeight pixels tall.
+	"""
+	width, height = frameSize
+	heights = [rect[3] - rect[1] for rect in rects if rect[3] > rect[1]]
+	if not heights or minGroupHeight <= 0:
+		return width, height
+	scale = minGroupHeight / min(heights)
+	for modeWidth, modeHeight in modes:
+		if modeWidth > width or modeHeight > height:
+			break
+		# same aspect ratio within 2%, the geometry stretch absorbs the rest
+		if modeHeight >= height * scale and abs(modeWidth * height - modeHeight * width) <= 0.02 * modeHeight * width:
+			return modeWidth, modeHeight
+	return width, height
@@ -0,0 +1,118 @@
+# coding: utf8
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+#histogram bucket upper bounds in seconds, the last bucket catches everything above
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+class LatencyHistogram():
+	"""Fixed-bucket latency histogram; percentiles are interpolated inside a bucket."""
+	def __init__(self, buckets = LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, seconds):
+		for i, bound in enumerate(self.buckets):
+			if seconds <= bound:
+				self.counts[i] += 1
+				break
+		self.count += 1
+		self.sum += seconds
+
+	def percentile(self, q):
+		if self.count == 0:
+			return 0.0
+		rank = q * self.count
+		cumulative = 0
+		for i, bucketCount in enumerate(self.counts):
+			if bucketCount and cumulative + bucketCount >= rank:
+				lower = self.buckets[i - 1] if i > 0 else 0.0
+				upper = self.buckets[i] if self.buckets[i] != float('inf') else lower
+				return lower + (upper - lower) * (rank - cumulative) / bucketCount
+			cumulative += bucketCount
+		return self.buckets[-2]
+
+def labelValue(text):
+	"""Escapes a Prometheus label value."""
+	return str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics():
+	"""Per-stage latency histograms and counters shared by the OCR and network threads."""
+	def __init__(self):
+		self.histograms = {}
+		self.counters = {}
+		self.group_counters = {} # counter name: {digit group name: value}
+		self._lock = threading.Lock()
+
+	def observe(self, stage, seconds):
+		with self._lock:
+			histogram = self.histograms.get(stage)
+			if histogram is None:
+				histogram = self.histograms[stage] = LatencyHistogram()
+			histogram.observe(seconds)
+
+	@contextmanager
+	def timer(self, stage):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(stage, time.perf_counter() - start)
+
+	def increment(self, name, value = 1):
+		with self._lock:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def set_counter(self, name, value):
+		"""Mirrors a total that is counted elsewhere, e.g. the capture ring drops."""
+		with self._lock:
+			self.counters[name] = value
+
+	def set_group_counters(self, name, values):
+		"""Mirrors a per digit group total; groups missing from values are dropped."""
+		with self._lock:
+			self.group_counters[name] = dict(values)
+
+	def snapshot(self):
+		with self._lock:
+			return {
+				"stages": {stage: {
+					"count": histogram.count,
+					"sum": histogram.sum,
+					"p50": histogram.percentile(0.50),
+					"p95": histogram.percentile(0.95),
+					"p99": histogram.percentile(0.99)
+				} for stage, histogram in self.histograms.items()},
+				"counters": dict(self.counters),
+				"groups": {name: dict(values) for name, values in self.group_counters.items()}
+			}
+
+	def prometheus(self):
+		"""Renders the metrics in the Prometheus text exposition format."""
+		lines = []
+		with self._lock:
+			lines.append("# TYPE ocr_stage_seconds histogram")
+			for stage, histogram in sorted(self.histograms.items()):
+				cumulative = 0
+				for bound, bucketCount in zip(histogram.buckets, histogram.counts):
+					cumulative += bucketCount
+					le = "+Inf" if bound == float('inf') else repr(bound)
+					lines.append('ocr_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, le, cumulative))
+				lines.append('ocr_stage_seconds_sum{{stage="{}"}} {}'.format(stage, histogram.sum))
+				lines.append('ocr_stage_seconds_count{{stage="{}"}} {}'.format(stage, histogram.count))
+			for name, value in sorted(self.counters.items()):
+				lines.append("# TYPE ocr_{}_total counter".format(name))
+				lines.append("ocr_{}_total {}".format(name, value))
+			for name, values in sorted(self.group_counters.items()):
+				lines.append("# TYPE ocr_{}_total counter".format(name))
+				for group, value in sorted(values.items()):
+					lines.append('ocr_{}_total{{group="{}"}} {}'.format(name, labelValue(group), value))
+		return "\n".join(lines) + "\n"
+
+#process-wide registry used by the pipeline, the Qt worker and the web server
+METRICS = Metrics()
@@ -0,0 +1,760 @@
+# coding: utf8
+
+from enum import Enum
+
+import logging
+
+import math
+import threading
+import time
+import numpy
+import cv2
+
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+
+#lookup table for seven-segment recognition
+DIGITS_LOOKUP = {
+    (1, 1, 1, 1, 1, 1, 0): 0,
+    (0, 1, 1, 0, 0, 0, 0): 1,
+    (1, 1, 0, 1, 1, 0, 1): 2,
+    (1, 1, 1, 1, 0, 0, 1): 3,
+    (0, 1, 1, 0, 0, 1, 1): 4,
+    (1, 0, 1, 1, 0, 1, 1): 5,
+    (0, 0, 1, 1, 1, 1, 1): 6,	#6 with activated high segment
+    (1, 0, 1, 1, 1, 1, 1): 6,	#6 with activated high segment
+    (1, 1, 1, 0, 0, 0, 0): 7,
+    (1, 1, 1, 1, 1, 1, 1): 8,
+    (1, 1, 1, 0, 0, 1, 1): 9,
+    (1, 1, 1, 1, 0, 1, 1): 9,	#9 with activated low segment
+    (0, 0, 0, 0, 0, 0, 0): ''
+}
+
+#segment sample rectangles in the 50x70 reference digit as (first row, last row, first col, last col), order a-g
+SEGMENT_RECTS = numpy.array([
+	[0, 19, 20, 29],
+	[20, 29, 30, 49],
+	[40, 49, 30, 49],
+	[50, 69, 20, 29],
+	[40, 49, 0, 19],
+	[20, 29, 0, 19],
+	[30, 39, 20, 29]], dtype=numpy.float64) / [70, 70, 50, 50]
+
+SEGMENT_WEIGHTS = 1 << numpy.arange(6, -1, -1) # segment a is the most significant bit
+SEGMENT_UNKNOWN = -1 # keep the previous digit
+SEGMENT_BLANK = 10 # all segments off
+
+def buildSegmentLookup():
+	"""Expands DIGITS_LOOKUP into a 128 entry array indexed by the 7-bit segment mask."""
+	lookup = numpy.full(128, SEGMENT_UNKNOWN, dtype=numpy.int8)
+	for segments, digit in DIGITS_LOOKUP.items():
+		lookup[int(numpy.dot(segments, SEGMENT_WEIGHTS))] = SEGMENT_BLANK if digit == '' else digit
+	return lookup
+
+SEGMENT_LOOKUP = buildSegmentLookup()
+
+def decodeDigitGroups(integral, digit_groups):
+	"""Decodes every digit of every group from one integral image of the binarized frame.
+	All segment rectangles are summed in a single vectorized pass; a segment is lit
+	when more than 55/255 of its pixels are set, the same cut-off the old per-digit
+	mean < 200 test on the inverted crop used.
+	"""
+	digits = []
+	boxes = []
+	for digitgrp in digit_groups:
+		for digit in digitgrp.digits:
+			digits.append(digit)
+			boxes.append((digitgrp.coords_num[0] + digit.coords_num[0], digitgrp.coords_num[1] + digit.coords_num[1],
+				digitgrp.coords_num[0] + digit.coords_num[2], digitgrp.coords_num[1] + digit.coords_num[3]))
+
+	if not digits:
+		return
+
+	rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+	boxes = numpy.array(boxes, dtype=numpy.int64)
+	x0 = numpy.clip(boxes[:, 0:1], 0, cols)
+	y0 = numpy.clip(boxes[:, 1:2], 0, rows)
+	w = numpy.clip(boxes[:, 2:3], 0, cols) - x0
+	h = numpy.clip(boxes[:, 3:4], 0, rows) - y0
+
+	# nearest-neighbour mapping of the reference rectangles onto each digit box
+	r0 = y0 + numpy.floor(SEGMENT_RECTS[:, 0] * h).astype(numpy.int64)
+	r1 = y0 + numpy.floor(SEGMENT_RECTS[:, 1] * h).astype(numpy.int64) + 1
+	c0 = x0 + numpy.floor(SEGMENT_RECTS[:, 2] * w).astype(numpy.int64)
+	c1 = x0 + numpy.floor(SEGMENT_RECTS[:, 3] * w).astype(numpy.int64) + 1
+	r1 = numpy.minimum(r1, y0 + h)
+	c1 = numpy.minimum(c1, x0 + w)
+
+	sums = integral[r1, c1].astype(numpy.int64) - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
+	lit = sums > 55 * (r1 - r0) * (c1 - c0)
+
+	codes = SEGMENT_LOOKUP[lit.astype(numpy.int64) @ SEGMENT_WEIGHTS]
+	codes[(w[:, 0] <= 0) | (h[:, 0] <= 0)] = SEGMENT_UNKNOWN
+
+	for digit, code in zip(digits, codes.tolist()):
+		if code == SEGMENT_UNKNOWN:
+			digit.misses += 1
+			continue
+		digit.misses = 0
+		digit.value = '' if code == SEGMENT_BLANK else code
+
+class DigitGroupType(Enum):
+	AUTOFIND = 1 # digit boxes are discovered from contours every frame
+	SINGLE = 2 # digit boxes are locked, only decoding runs
+
+class DigitGroup():
+	def __init__(self, name):
+		self.name = name
+		self.type = DigitGroupType.AUTOFIND
+		self.coords = ["","","",""]
+		self.coords_num = [0,0,0,0]
+		self.digits = []
+		self.enabled = False
+
+		self.previousImage = None # binarized crop of the last processed frame
+		self.diffImage = None # reused absdiff output
+		self.frames_processed = 0
+		self.frames_skipped = 0
+
+		self.stable_frames = 0 # processed frames without a digit box change
+		self.unlock_misses = 3 # consecutive undecodable frames of a digit that unlock the layout
+		self.tracked_digits = [] # digits that decoded when the layout locked, only these unlock it
+		self.outside_lit = 0 # lit pixels outside the digit boxes when the layout locked
+		self.outsideImage = None # reused crop with the digit boxes blanked
+
+	@property
+	def value(self):
+		value = ""
+		for digit in sorted(self.digits, key=lambda x: x.coords_num[0]):
+			value += str(digit.value)
+		return value
+
+	def has_changed(self, croppedImage, change_tolerance):
+		"""Compares the binarized crop with the previous frame.
+		Returns False when no more than change_tolerance pixels differ.
+		"""
+		if self.previousImage is None or self.previousImage.shape != croppedImage.shape:
+			self.previousImage = croppedImage.copy()
+			return True
+
+		if self.diffImage is None or self.diffImage.shape != croppedImage.shape:
+			self.diffImage = numpy.empty_like(croppedImage)
+		changed = cv2.countNonZero(cv2.absdiff(croppedImage, self.previousImage, dst=self.diffImage)) > change_tolerance
+		if changed:
+			numpy.copyto(self.previousImage, croppedImage)
+		return changed
+
+	def lit_outside_digits(self, croppedImage):
+		"""Lit pixels of the binarized crop that no digit box covers."""
+		if self.outsideImage is None or self.outsideImage.shape != croppedImage.shape:
+			self.outsideImage = numpy.empty_like(croppedImage)
+		numpy.copyto(self.outsideImage, croppedImage)
+		for digit in self.digits:
+			self.outsideImage[digit.coords_num[1]:digit.coords_num[3], digit.coords_num[0]:digit.coords_num[2]] = 0
+		return cv2.countNonZero(self.outsideImage)
+
+	def lock_layout(self, croppedImage):
+		# boxes that never decoded, e.g. a colon or a noise blob, must not unlock the layout again
+		self.tracked_digits = [digit for digit in self.digits if digit.misses == 0]
+		self.outside_lit = self.lit_outside_digits(croppedImage)
+		for digit in self.digits:
+			digit.misses = 0
+		self.type = DigitGroupType.SINGLE
+
+	def reset_layout(self, clear_digits = True):
+		"""Returns the group to contour discovery, optionally forgetting the digit boxes."""
+		self.type = DigitGroupType.AUTOFIND
+		self.stable_frames = 0
+		self.tracked_digits = []
+		# the next frame is processed even if the pixels did not change
+		self.previousImage = None
+		if clear_digits:
+			self.digits.clear()
+
+	def processDigits(self, image, change_tolerance = None, lock_after = None):
+		"""Updates the digit boxes from the contours in this group's rectangle.
+		With a change_tolerance, an unchanged rectangle is skipped and the
+		previous value kept. Returns False when the group was skipped.
+		With lock_after, the layout locks once the boxes have not changed for
+		that many processed frames, and unlocks when a digit stops decoding or
+		lit pixels appear outside the locked boxes, e.g. a new leading digit.
+		"""
+		croppedImage = image[self.coords_num[1]:self.coords_num[3], self.coords_num[0]:self.coords_num[2]]
+		if croppedImage.size == 0:
+			return False
+
+		if change_tolerance is not None and not self.has_changed(croppedImage, change_tolerance):
+			self.frames_skipped += 1
+			return False
+		self.frames_processed += 1
+
+		if self.type == DigitGroupType.SINGLE:
+			if any(digit.misses >= self.unlock_misses for digit in self.tracked_digits):
+				logging.info("Digit group %s lost its digits, unlocking layout", self.name)
+				self.reset_layout(clear_digits = False)
+			elif self.lit_outside_digits(croppedImage) > self.outside_lit + (change_tolerance or 0):
+				logging.info("Digit group %s has new digits, unlocking layout", self.name)
+				self.reset_layout(clear_digits = False)
+			else:
+				return True
+
+		layoutChanged = False
+		contours, hierarchy = cv2.findContours(croppedImage, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+		logging.debug("Number of contours found: %s", str(len(contours)))
+
+		#go through contours and update/create digits
+		for contour in contours:
+			x,y,w,h = cv2.boundingRect(contour)
+			area = w*h
+			if (area) > 700:
+				#find centroids
+				M = cv2.moments(contour)
+				cx = int(M['m10']/M['m00'])
+				cy = int(M['m01']/M['m00'])
+				inDigit = False
+				for digit in self.digits:
+					#check if contour centroid is in this stored digit
+					if (digit.coords_num[0] < cx < digit.coords_num[2]) and (digit.coords_num[1] < cy < digit.coords_num[3]):
+						inDigit = True
+						if (digit.contour_area < area or digit.contour_width < w or digit.contour_height < h):
+							digit.coords = [str(x), str(y), str(x+w), str(y+h)]
+							digit.coords_num = [x, y, x+w, y+h]
+							layoutChanged = True
+						break
+
+				if not inDigit:
+					newDigit = SingleDigit(self.name)
+					newDigit.enabled = True
+					newDigit.coords = [str(x), str(y), str(x+w), str(y+h)]
+					newDigit.coords_num = [x, y, x+w, y+h]
+					self.digits.append(newDigit)
+					layoutChanged = True
+
+		if layoutChanged or not self.digits:
+			self.stable_frames = 0
+		else:
+			self.stable_frames += 1
+			if lock_after is not None and self.stable_frames >= lock_after:
+				logging.info("Digit group %s layout locked with %u digits", self.name, len(self.digits))
+				self.lock_layout(croppedImage)
+
+		return True
+
+class SingleDigit():
+	def __init__(self, name):
+		self.name = name
+		self.coords = ["","","",""]
+		self.coords_num = [0,0,0,0]
+		self.value = ""
+		self.enabled = False
+		self.misses = 0 # consecutive frames the segments matched no digit
+
+	@property
+	def contour_height(self):
+		return self.coords_num[3] - self.coords_num[1]
+	
+	@property
+	def contour_width(self):
+		return self.coords_num[2] - self.coords_num[0]
+	
+	@property
+	def contour_area(self):
+		return self.contour_width * self.contour_height
+
+class GeometryTransform():
+	"""Crop, rotation and shear of the frame folded into one composite transform.
+	The transform is compiled once into fixed-point cv2.remap tables, so each frame
+	costs a single table lookup instead of a border copy and two full-frame warps.
+	When the frames are captured at another size than the one the coordinates and
+	crop refer to (coordinate_shape), the remap also scales them to that size.
+	"""
+	def __init__(self, params, frame_shape, coordinate_shape = None):
+		self.key = GeometryTransform.make_key(params, frame_shape, coordinate_shape)
+		self.frame_shape = tuple(frame_shape[:2])
+		self.coordinate_shape = tuple(coordinate_shape[:2]) if coordinate_shape is not None else self.frame_shape
+
+		height, width = self.coordinate_shape
+		self.rows = height - params.cropTop
+		self.cols = width - params.cropLeft
+
+		# crop, rotation around the center of the cropped image, then shear
+		T = numpy.float64([[1, 0, -params.cropLeft], [0, 1, -params.cropTop], [0, 0, 1]])
+		R = numpy.vstack([cv2.getRotationMatrix2D((self.cols/2, self.rows/2), params.rotation, 1), [0, 0, 1]])
+		Sh = numpy.float64([[1, math.tan(params.skewx*math.pi/180), 0],
+						[math.tan(params.skewy*math.pi/180), 1, 0],
+						[0, 0, 1]])
+		self.matrix = Sh @ R @ T # coordinate pixel -> output pixel
+
+		self.map1, self.map2, self.pad_mask = self.build_maps(numpy.linalg.inv(Sh), numpy.linalg.inv(R), numpy.linalg.inv(T))
+
+	@staticmethod
+	def make_key(params, frame_shape, coordinate_shape = None):
+		coordinate_shape = tuple(coordinate_shape[:2]) if coordinate_shape is not None else tuple(frame_shape[:2])
+		return (frame_shape[0], frame_shape[1], coordinate_shape, params.rotation, params.skewx, params.skewy, params.cropLeft, params.cropTop)
+
+	def build_maps(self, Sh_inv, R_inv, T_inv):
+		height, width = self.coordinate_shape
+		scaleY, scaleX = self.frame_shape[0] / height, self.frame_shape[1] / width
+		xs, ys = numpy.meshgrid(numpy.arange(self.cols, dtype=numpy.float64), numpy.arange(self.rows, dtype=numpy.float64))
+		points = numpy.stack([xs, ys, numpy.ones_like(xs)])
+
+		# walk every output pixel back through each stage, so pixels the separate
+		# warps would have dropped at an intermediate canvas edge stay black
+		sheared = numpy.tensordot(Sh_inv, points, 1)
+		rotated = numpy.tensordot(R_inv, sheared, 1)
+		source = numpy.tensordot(T_inv, rotated, 1)
+
+		inCanvas = (0 <= sheared[0]) & (sheared[0] < self.cols) & (0 <= sheared[1]) & (sheared[1] < self.rows) \
+			& (0 <= rotated[0]) & (rotated[0] < self.cols) & (0 <= rotated[1]) & (rotated[1] < self.rows)
+		inSource = (0 <= source[0]) & (source[0] < width) & (0 <= source[1]) & (source[1] < height)
+
+		# pixel centers line up between the coordinate and the captured size, exact for scale 1
+		mapx = numpy.where(inCanvas, (source[0] + 0.5) * scaleX - 0.5, -10).astype(numpy.float32)
+		mapy = numpy.where(inCanvas, (source[1] + 0.5) * scaleY - 0.5, -10).astype(numpy.float32)
+		map1, map2 = cv2.convertMaps(mapx, mapy, cv2.CV_16SC2)
+
+		# negative crops pad the frame with white
+		pad = inCanvas & ~inSource
+		pad_mask = cv2.merge([pad.astype(numpy.uint8) * 255] * 3) if pad.any() else None
+
+		return map1, map2, pad_mask
+
+	def clip_rect(self, rect, margin = 0):
+		"""Grows an output rectangle by margin and clips it to the output image."""
+		return [max(0, min(self.cols, rect[0] - margin)), max(0, min(self.rows, rect[1] - margin)),
+			max(0, min(self.cols, rect[2] + margin)), max(0, min(self.rows, rect[3] + margin))]
+
+	def output_shape(self, img, rect = None):
+		if rect is None:
+			return (self.rows, self.cols) + img.shape[2:]
+		return (rect[3] - rect[1], rect[2] - rect[0]) + img.shape[2:]
+
+	def apply(self, img, rect = None, dst = None):
+		"""Warps the whole frame, or only the output rectangle [x0, y0, x1, y1].
+		The remap table slice of a rectangle holds its back-projection into the
+		source frame, so only those source pixels are read.
+		"""
+		if rect is None:
+			map1, map2, pad_mask = self.map1, self.map2, self.pad_mask
+		else:
+			x0, y0, x1, y1 = rect
+			map1, map2 = self.map1[y0:y1, x0:x1], self.map2[y0:y1, x0:x1]
+			pad_mask = self.pad_mask[y0:y1, x0:x1] if self.pad_mask is not None else None
+
+		img_warped = cv2.remap(img, map1, map2, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+		if pad_mask is not None:
+			cv2.max(img_warped, pad_mask, dst=img_warped)
+		return img_warped
+
+class BufferPool():
+	"""Reusable arrays keyed by name, handed to OpenCV calls as dst.
+	A buffer is only reallocated when the requested shape or dtype changes,
+	i.e. when the frame size, crop or digit group rectangles change.
+	"""
+	def __init__(self):
+		self.buffers = {}
+		self.allocations = 0
+
+	def get(self, key, shape, dtype = numpy.uint8):
+		buffer = self.buffers.get(key)
+		if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+			buffer = self.buffers[key] = numpy.empty(shape, dtype)
+			self.allocations += 1
+		return buffer
+
+	def clear(self):
+		self.buffers.clear()
+
+def morphologyKernel(iterations):
+	"""Structuring element equal to `iterations` passes of the 2x2 ones kernel.
+	The Minkowski sum of n 2x2 squares anchored at (1,1) is an (n+1)x(n+1)
+	square anchored at (n,n), so a single pass gives bit-identical output.
+	"""
+	return numpy.ones((iterations + 1, iterations + 1), numpy.uint8), (iterations, iterations)
+
+def optionalCount(value):
+	"""int of a setting that can be turned off: None for None, an empty string or a negative value."""
+	if value is None or value == "":
+		return None
+	value = int(value)
+	return value if value >= 0 else None
+
+class ScOcrWorkerParams():
+	def __init__(self, waitKey, videoCaptureIndex, rotation, skewx, skewy, erosion, dilate, threshold, cropLeft, cropTop, autocrop_enabled, autocrop_coords, roiOnly = True, changeTolerance = 8, lockLayoutFrames = 50, previewEnabled = True, previewInterval = 200, previewScale = 0.5, captureDecimation = 1, captureFps = 0, sourceFourcc = "", sourceWidth = 960, sourceHeight = 540, sourceFps = 0, sourceBufferSize = 0, sourceMinGroupHeight = 0, groupThreads = 1):
+		self.waitKey = int(waitKey) # target processing period in ms, 0 for the camera rate
+		self.videoCaptureIndex = videoCaptureIndex
+		self.rotation = int(rotation)
+		self.skewx = int(skewx)
+		self.skewy = int(skewy)
+		self.erosion = int(erosion)
+		self.dilate = int(dilate)
+		self.threshold = int(threshold)
+		self.cropLeft = int(cropLeft)
+		self.cropTop = int(cropTop)
+		self.autocrop_enabled = autocrop_enabled
+		self.autocrop_coords = autocrop_coords
+		self.roiOnly = roiOnly # process only the digit group rectangles, the whole frame while the preview is enabled
+		self.changeTolerance = optionalCount(changeTolerance) # changed pixels below which a digit group is skipped, None to always process
+		self.lockLayoutFrames = optionalCount(lockLayoutFrames) # stable frames after which digit boxes are locked, None to never lock
+		self.previewEnabled = previewEnabled
+		self.previewInterval = int(previewInterval) # minimum ms between preview frames
+		self.previewScale = float(previewScale) # preview size relative to the processed frame
+		self.captureDecimation = max(1, int(captureDecimation)) # decode only every Nth captured frame
+		self.captureFps = float(captureFps) # decode at most this many frames per second, 0 for no limit
+		self.sourceFourcc = sourceFourcc # capture pixel format such as "MJPG" or "YUYV", empty for the driver default
+		self.sourceWidth = int(sourceWidth) # capture size the digit coordinates refer to, 0 for the driver default
+		self.sourceHeight = int(sourceHeight)
+		self.sourceFps = float(sourceFps) # 0 for the driver default, or the native rate of a recording
+		self.sourceBufferSize = int(sourceBufferSize) # driver queue depth, 0 for the driver default
+		self.sourceMinGroupHeight = int(sourceMinGroupHeight) # pick the smallest capture size that keeps every digit group rectangle this tall, 0 to capture at sourceWidth x sourceHeight
+		self.groupThreads = max(1, int(groupThreads)) # digit groups processed concurrently, 1 processes them in order on the calling thread
+
+class OcrCoordinate():
+	"""Plain digit group definition, usable without the GUI.
+	Mirrors the coordinate accessors of OcrCoordinateGui.
+	"""
+	def __init__(self, name, coords = None):
+		self.name = name
+		self.coords = list(coords) if coords is not None else ["","","",""]
+
+	def get_text_coords(self):
+		return [str(coord) for coord in self.coords]
+
+	def get_coords(self):
+		return [int('0' + str(coord)) for coord in self.coords]
+
+class OcrPipeline():
+	"""Headless OCR core: takes a BGR frame, updates the digit groups.
+	Has no Qt dependency, so it can run on machines without a display.
+	"""
+	def __init__(self, ocr_coords, params, metrics = METRICS):
+		self.digit_groups = []
+		self.metrics = metrics
+
+		self.geometry = None # GeometryTransform, built on the first frame
+		self.coordinate_shape = None # (rows, cols) the coordinates refer to if frames are captured at another size
+		self.img_roi = None # binarized output of the ROI-only path
+		self.buffers = BufferPool() # per-frame intermediate images
+		self.kernels = {} # structuring elements by iteration count
+		self.executor = None # ThreadPoolExecutor for the digit groups, kept across frames
+		self.executor_threads = 0
+
+		#ocr pipeline parameters
+		self.params = params
+
+		self.coords = ocr_coords #coordinates list without graphics
+
+		self.update_ocr_coordinates(ocr_coords)
+
+	def update_params(self, new_params):
+		if self.geometry is not None and self.geometry.key != GeometryTransform.make_key(new_params, self.geometry.frame_shape, self.coordinate_shape):
+			self.geometry = None
+		self.img_roi = None
+		self.params = new_params
+
+	def update_ocr_coordinates(self, ocr_coords):
+		self.coords = ocr_coords
+		self.img_roi = None
+		self.buffers.clear()
+
+		self.digit_groups.clear()
+
+		for coord in self.coords:
+			newDigitGrp = DigitGroup(coord.name)
+			newDigitGrp.coords = coord.get_text_coords()
+			newDigitGrp.coords_num = coord.get_coords()
+			self.digit_groups.append(newDigitGrp)
+
+	def readings(self):
+		return {digitgrp.name: digitgrp.value for digitgrp in self.digit_groups}
+
+	def skip_counters(self):
+		return {digitgrp.name: digitgrp.frames_skipped for digitgrp in self.digit_groups}
+
+	def process_counters(self):
+		return {digitgrp.name: digitgrp.frames_processed for digitgrp in self.digit_groups}
+
+	def reset_layout(self, name = None):
+		"""Restarts digit discovery for one digit group, or for all of them."""
+		for digitgrp in self.digit_groups:
+			if name is None or digitgrp.name == name:
+				digitgrp.reset_layout()
+
+	def get_geometry(self, img):
+		if self.geometry is None or self.geometry.key != GeometryTransform.make_key(self.params, img.shape, self.coordinate_shape):
+			self.geometry = GeometryTransform(self.params, img.shape, self.coordinate_shape)
+			self.img_roi = None
+			self.buffers.clear()
+		return self.geometry
+
+	def adjust_img_geometry(self, img, rect = None, key = "frame"):
+		if (self.params.autocrop_enabled):
+			#TODO, just return the input image for now
+			img_processed = img
+		else:
+			geometry = self.get_geometry(img)
+			shape = geometry.output_shape(img, rect)
+			img_processed = geometry.apply(img, rect, dst = self.buffers.get((key, "warped"), shape))
+
+		return img_processed
+
+	def get_kernel(self, iterations):
+		kernel = self.kernels.get(iterations)
+		if kernel is None:
+			kernel = self.kernels[iterations] = morphologyKernel(iterations)
+		return kernel
+
+	def adjust_img_morphology(self, img, key = "frame"):
+		# HSV value is max(B, G, R), so V > threshold unless every channel is <= threshold
+		shape = img.shape[:2]
+		upper = (self.params.threshold,) * (img.shape[2] if img.ndim == 3 else 1)
+		img_th = cv2.inRange(img, (0,) * len(upper), upper, dst = self.buffers.get((key, "threshold"), shape))
+		img_processed = cv2.bitwise_not(img_th, dst = img_th)
+
+		# one pass each with the structuring element of the iterated 2x2 passes
+		if self.params.erosion > 0:
+			kernel, anchor = self.get_kernel(self.params.erosion)
+			img_processed = cv2.erode(img_processed, kernel, dst = self.buffers.get((key, "eroded"), shape), anchor = anchor)
+		if self.params.dilate > 0:
+			kernel, anchor = self.get_kernel(self.params.dilate)
+			img_processed = cv2.dilate(img_processed, kernel, dst = self.buffers.get((key, "binary"), shape), anchor = anchor)
+
+		return img_processed
+
+	def roi_rects(self, geometry):
+		"""Digit group rectangles clipped to the output image, empty ones dropped."""
+		rects = []
+		for digitgrp in self.digit_groups:
+			rect = geometry.clip_rect(digitgrp.coords_num)
+			if rect[2] > rect[0] and rect[3] > rect[1]:
+				rects.append(rect)
+		return rects
+
+	def adjust_img_regions(self, img, rects):
+		"""Warps and binarizes only the given output rectangles.
+		Each rectangle is padded by the reach of the erode/dilate passes, so the
+		pixels inside it come out the same as with full-frame processing.
+		"""
+		geometry = self.get_geometry(img)
+		if self.img_roi is None:
+			self.img_roi = numpy.zeros((geometry.rows, geometry.cols), numpy.uint8)
+
+		margin = self.params.erosion + self.params.dilate + 1
+		geometryTime = 0.0
+		morphologyTime = 0.0
+		for i, rect in enumerate(rects):
+			padded = geometry.clip_rect(rect, margin)
+			start = time.perf_counter()
+			img_transformed = self.adjust_img_geometry(img, padded, key = i)
+			split = time.perf_counter()
+			img_binary = self.adjust_img_morphology(img_transformed, key = i)
+			self.img_roi[rect[1]:rect[3], rect[0]:rect[2]] = img_binary[rect[1] - padded[1]:rect[3] - padded[1], rect[0] - padded[0]:rect[2] - padded[0]]
+			geometryTime += split - start
+			morphologyTime += time.perf_counter() - split
+
+		self.metrics.observe("geometry", geometryTime)
+		self.metrics.observe("morphology", morphologyTime)
+		return self.img_roi
+
+	def get_executor(self):
+		"""Thread pool for the digit groups, None when groupThreads is 1."""
+		threads = self.params.groupThreads
+		if self.executor is not None and self.executor_threads != threads:
+			self.close()
+		if threads > 1 and self.executor is None:
+			self.executor = ThreadPoolExecutor(max_workers = threads, thread_name_prefix = "ocr-group")
+			self.executor_threads = threads
+		return self.executor
+
+	def close(self):
+		if self.executor is not None:
+			self.executor.shutdown(wait = False)
+			self.executor = None
+			self.executor_threads = 0
+
+	def process_group(self, index, digitgrp, img, geometry):
+		"""Warps and binarizes one group's rectangle into img_roi and reads its digit boxes.
+		Runs on the group thread pool: every group owns its buffers and digits, and
+		overlapping rectangles write the same pixels, so the groups need no locking.
+		Returns (processed, geometry seconds, morphology seconds, digits seconds).
+		"""
+		start = split = done = time.perf_counter()
+		if geometry is not None:
+			rect = geometry.clip_rect(digitgrp.coords_num)
+			if rect[2] > rect[0] and rect[3] > rect[1]:
+				padded = geometry.clip_rect(rect, self.params.erosion + self.params.dilate + 1)
+				img_transformed = self.adjust_img_geometry(img, padded, key = ("group", index))
+				split = time.perf_counter()
+				img_binary = self.adjust_img_morphology(img_transformed, key = ("group", index))
+				self.img_roi[rect[1]:rect[3], rect[0]:rect[2]] = img_binary[rect[1] - padded[1]:rect[3] - padded[1], rect[0] - padded[0]:rect[2] - padded[0]]
+				done = time.perf_counter()
+		image = self.img_roi if geometry is not None else img
+		processed = digitgrp.processDigits(image, self.params.changeTolerance, self.params.lockLayoutFrames)
+		return processed, split - start, done - split, time.perf_counter() - done
+
+	def process_groups(self, executor, img, geometry):
+		"""Runs process_group for every digit group on the pool and waits for all of them.
+		With a geometry the groups also warp their own rectangles of img, otherwise
+		img is the binarized frame. Returns the groups that were processed.
+		"""
+		if geometry is not None and self.img_roi is None:
+			self.img_roi = numpy.zeros((geometry.rows, geometry.cols), numpy.uint8)
+
+		with self.metrics.timer("groups"):
+			futures = [executor.submit(self.process_group, i, digitgrp, img, geometry) for i, digitgrp in enumerate(self.digit_groups)]
+			results = [future.result() for future in futures]
+
+		if geometry is not None:
+			self.metrics.observe("geometry", sum(result[1] for result in results))
+			self.metrics.observe("morphology", sum(result[2] for result in results))
+		self.metrics.observe("digits", sum(result[3] for result in results))
+		return [digitgrp for digitgrp, result in zip(self.digit_groups, results) if result[0]]
+
+	def process_frame(self, img):
+		"""Runs one BGR frame through the pipeline.
+		Returns the binarized image the digit groups were read from.
+		"""
+		rects = None
+		# the processed preview shows the whole frame, new groups are placed on it
+		if self.params.roiOnly and not self.params.previewEnabled and not self.params.autocrop_enabled:
+			rects = self.roi_rects(self.get_geometry(img))
+
+		executor = self.get_executor() if len(self.digit_groups) > 1 else None
+		if executor is not None and rects:
+			changed = self.process_groups(executor, img, self.get_geometry(img))
+			img_processed = self.img_roi
+		else:
+			if rects:
+				img_processed = self.adjust_img_regions(img, rects)
+			else:
+				with self.metrics.timer("geometry"):
+					img_transformed = self.adjust_img_geometry(img)
+				with self.metrics.timer("morphology"):
+					img_processed = self.adjust_img_morphology(img_transformed)
+
+			if executor is not None:
+				changed = self.process_groups(executor, img_processed, None)
+			else:
+				with self.metrics.timer("digits"):
+					changed = [digitgrp for digitgrp in self.digit_groups if digitgrp.processDigits(img_processed, self.params.changeTolerance, self.params.lockLayoutFrames)]
+
+		with self.metrics.timer("decode"):
+			if changed:
+				integral = self.buffers.get("integral", (img_processed.shape[0] + 1, img_processed.shape[1] + 1), numpy.int32)
+				decodeDigitGroups(cv2.integral(img_processed, sum = integral, sdepth = cv2.CV_32S), changed)
+
+		self.metrics.increment("frames_processed")
+		self.metrics.increment("groups_skipped", len(self.digit_groups) - len(changed))
+		self.metrics.set_group_counters("group_skipped", self.skip_counters())
+		self.metrics.set_group_counters("group_processed", self.process_counters())
+
+		return img_processed
+
+	def draw_overlay(self, img_processed, scale = 1.0, dst = None):
+		with self.metrics.timer("overlay"):
+			return self._draw_overlay(img_processed, scale, dst)
+
+	def _draw_overlay(self, img_processed, scale, dst):
+		##### PRELIMINARY PROCESSED IMAGE WITH BOUNDING BOXES, X, Y #####
+		if scale != 1.0:
+			size = scaledSize(img_processed, scale)
+			img_processed = cv2.resize(img_processed, size, dst = self.buffers.get("overlay_small", size[::-1]), interpolation = cv2.INTER_AREA)
+		img_disp = cv2.cvtColor(img_processed, cv2.COLOR_GRAY2BGR, dst = dst)
+
+		def point(x, y):
+			return (int(x * scale), int(y * scale))
+
+		# show bounding boxes and preliminary numbers
+		shapes = self.buffers.get("overlay_shapes", img_disp.shape)
+		shapes.fill(0)
+
+		for digitgrp in self.digit_groups:
+			cv2.rectangle(shapes, point(digitgrp.coords_num[0], digitgrp.coords_num[1]), point(digitgrp.coords_num[2], digitgrp.coords_num[3]), (0,0,255), cv2.FILLED)
+			cv2.putText(img_disp, str(digitgrp.value), point(digitgrp.coords_num[2] - 10, digitgrp.coords_num[3] + 10), cv2.FONT_ITALIC, 0.4, (255,255,0))
+			for digit in digitgrp.digits:
+				cv2.rectangle(shapes, point(digitgrp.coords_num[0] + digit.coords_num[0], digitgrp.coords_num[1] + digit.coords_num[1]), point(digitgrp.coords_num[0] + digit.coords_num[2], digitgrp.coords_num[1] + digit.coords_num[3]), (0,255,0), cv2.FILLED)
+
+		alpha = 0.6
+
+		return cv2.addWeighted(img_disp, 1, shapes, 1-alpha, 0.5, dst = img_disp)
+
+def scaledSize(img, scale):
+	"""cv2 (width, height) of img scaled by scale, at least one pixel."""
+	return (max(1, int(round(img.shape[1] * scale))), max(1, int(round(img.shape[0] * scale))))
+
+class PreviewBuffers():
+	"""Raw and overlay preview images that stay untouched until the consumer releases them."""
+	def __init__(self, pool):
+		self.pool = pool
+		self.raw = None
+		self.overlay = None
+		self.in_use = False
+
+	def release(self):
+		self.pool.release(self)
+
+class PreviewBufferPool():
+	"""Small pool of PreviewBuffers with reference tracking.
+	Lets the consumer wrap the images without copying them; when every pair
+	is still held by the consumer, no new preview is rendered.
+	"""
+	def __init__(self, size = 2):
+		self.slots = [PreviewBuffers(self) for i in range(size)]
+		self.exhausted = 0 # previews skipped because the consumer held every pair
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		with self._lock:
+			for slot in self.slots:
+				if not slot.in_use:
+					slot.in_use = True
+					return slot
+			self.exhausted += 1
+			return None
+
+	def release(self, slot):
+		with self._lock:
+			slot.in_use = False
+
+class PreviewRenderer():
+	"""Rate-limited, downscaled preview of the raw frame and the overlay.
+	Kept apart from process_frame so preview cost does not limit OCR throughput.
+	"""
+	def __init__(self, pipeline):
+		self.pipeline = pipeline
+		self.last_render = None
+		self.pool = PreviewBufferPool()
+
+	def due(self, now):
+		params = self.pipeline.params
+		if not params.previewEnabled:
+			return False
+		return self.last_render is None or now - self.last_render >= params.previewInterval / 1000
+
+	def render(self, img, img_processed, now):
+		"""Renders the downscaled raw frame and the processed image with overlay boxes
+		into a free PreviewBuffers pair, which the consumer must release.
+		Returns None while the consumer holds every pair.
+		"""
+		slot = self.pool.acquire()
+		if slot is None:
+			return None
+
+		self.last_render = now
+		scale = self.pipeline.params.previewScale
+		with self.pipeline.metrics.timer("preview"):
+			size = scaledSize(img, scale)
+			if slot.raw is None or slot.raw.shape != (size[1], size[0]) + img.shape[2:]:
+				slot.raw = numpy.empty((size[1], size[0]) + img.shape[2:], img.dtype)
+			if scale == 1.0:
+				numpy.copyto(slot.raw, img)
+			else:
+				cv2.resize(img, size, dst = slot.raw, interpolation = cv2.INTER_AREA)
+
+			size = scaledSize(img_processed, scale)
+			if slot.overlay is None or slot.overlay.shape != (size[1], size[0], 3):
+				slot.overlay = numpy.empty((size[1], size[0], 3), numpy.uint8)
+		self.pipeline.draw_overlay(img_processed, scale, dst = slot.overlay)
+		return slot
@@ -0,0 +1,177 @@
+# coding: utf8
+
+import logging
+import threading
+import time
+
+from capture import CaptureThread, FrameRingBuffer, FrameScheduler
+from framesource import frameSource, roiSourceSize
+from metrics import METRICS
+from ocrpipeline import OcrPipeline
+from publisher import OcrResult, ResultPublisher
+
+class OcrRunner():
+	"""Capture and OCR loop of one camera, without Qt: a CaptureThread fills the
+	ring, run() takes the newest frame, processes it with OcrPipeline and
+	publishes an OcrResult to the subscribers of self.publisher, paced by a
+	FrameScheduler. The GUI wraps it in ScOcrWorker, the engine runs it as is.
+	Changes from other threads are queued and applied by run() between frames.
+	"""
+	def __init__(self, ocr_coords, params):
+		self._isRunning = False
+		self._isPaused = False
+		self._state = threading.Condition() # guards _isRunning, _isPaused and the pending changes below
+		# changes from other threads, applied by the OCR thread between frames
+		self._pending_params = None
+		self._pending_coords = None
+		self._layout_resets = [] # digit group names, None for all
+
+		self.pipeline = OcrPipeline(ocr_coords, params)
+		self.publisher = ResultPublisher()
+		self.on_frame = None # called as on_frame(frame, img_processed) on the OCR thread before the frame goes back to the ring
+
+		self.cam = None # FrameSource, opened in run()
+		self.ring = FrameRingBuffer()
+		self.capture_thread = None # CaptureThread, started in run()
+		self.scheduler = FrameScheduler()
+
+	@property
+	def params(self):
+		return self.pipeline.params
+
+	@property
+	def digit_groups(self):
+		return self.pipeline.digit_groups
+
+	@property
+	def running(self):
+		return self._isRunning
+
+	def update_params(self, new_params):
+		with self._state:
+			self._pending_params = new_params
+
+	def update_ocr_coordinates(self, ocr_coords):
+		"""Replaces the digit groups with plain OcrCoordinate definitions."""
+		with self._state:
+			self._pending_coords = ocr_coords
+
+	def reset_layout(self, name = None):
+		"""Restarts digit discovery of one digit group, or of all; applied on the OCR thread."""
+		with self._state:
+			self._layout_resets.append(name)
+
+	def apply_pending(self):
+		"""Applies the queued parameter, coordinate and layout changes; OCR thread only."""
+		with self._state:
+			params, self._pending_params = self._pending_params, None
+			coords, self._pending_coords = self._pending_coords, None
+			resets, self._layout_resets = self._layout_resets, []
+		if params is not None:
+			self.pipeline.update_params(params)
+			if self.capture_thread is not None:
+				self.capture_thread.set_rate(params.captureDecimation, params.captureFps)
+		if coords is not None:
+			self.pipeline.update_ocr_coordinates(coords)
+		for name in resets:
+			self.pipeline.reset_layout(name)
+
+	def pause(self):
+		with self._state:
+			self._isPaused = not self._isPaused
+			self._state.notify_all()
+			if self.capture_thread is not None:
+				self.capture_thread.set_paused(self._isPaused)
+
+	def stop(self):
+		"""Ends run() after the current frame; the source is released by run()."""
+		with self._state:
+			self._isRunning = False
+			self._state.notify_all()
+		self.scheduler.wake()
+		if self.capture_thread is not None:
+			self.capture_thread.stop()
+
+	def open(self):
+		params = self.params
+		self.cam = frameSource(params.videoCaptureIndex, fourcc = params.sourceFourcc, width = params.sourceWidth,
+			height = params.sourceHeight, fps = params.sourceFps, bufferSize = params.sourceBufferSize)
+
+		# capture only as many pixels as the digit groups need, the geometry scales them back to the coordinate size
+		if params.sourceMinGroupHeight > 0 and params.sourceWidth > 0 and params.sourceHeight > 0:
+			rects = [digitgrp.coords_num for digitgrp in self.digit_groups]
+			self.cam.width, self.cam.height = roiSourceSize((params.sourceWidth, params.sourceHeight), rects, params.sourceMinGroupHeight)
+			self.pipeline.coordinate_shape = (params.sourceHeight, params.sourceWidth)
+			logging.info("Capture size %ux%u for %u px digit groups", self.cam.width, self.cam.height, params.sourceMinGroupHeight)
+		else:
+			self.pipeline.coordinate_shape = None
+		self.cam.open()
+
+		# pace recorded sources at their native rate, live sources deliver at their own rate
+		self.ring = FrameRingBuffer()
+		self.capture_thread = CaptureThread(self.cam, self.ring, self.cam.pace_fps(), params.captureDecimation, params.captureFps, self.scheduler)
+		with self._state:
+			self.capture_thread.set_paused(self._isPaused)
+			if not self._isRunning:
+				self.capture_thread.stop()
+		self.capture_thread.start()
+
+	def close(self):
+		if self.capture_thread is not None:
+			self.capture_thread.stop()
+			self.capture_thread.join()
+		if self.cam is not None:
+			self.cam.release()
+		self.pipeline.close()
+
+	def run(self):
+		"""Processes frames until stop() or the end of the source, on the calling thread."""
+		with self._state:
+			self._isRunning = True
+		try:
+			self.apply_pending()
+			self.open()
+
+			while self._isRunning:
+				# close the OCR session if cam is not available or is closed
+				if not self.cam.isOpened():
+					break
+
+				# pause the OCR session until resumed or stopped
+				with self._state:
+					self._state.wait_for(lambda: not self._isPaused or not self._isRunning)
+				if not self._isRunning:
+					break
+
+				frame = self.ring.acquire(timeout = 1.0)
+
+				# get out if the capture ended
+				if frame is None:
+					if self.ring.finished:
+						break
+					continue
+
+				METRICS.observe("capture", time.monotonic() - frame.timestamp)
+				METRICS.set_counter("frames_grabbed", self.capture_thread.frames_grabbed)
+				METRICS.set_counter("frames_decode_skipped", self.capture_thread.frames_skipped)
+				METRICS.set_counter("frames_captured", self.ring.frames_captured)
+				METRICS.set_counter("frames_dropped", self.ring.frames_dropped)
+
+				self.apply_pending()
+
+				img_processed = self.pipeline.process_frame(frame.image)
+
+				self.publisher.publish(OcrResult.from_pipeline(self.pipeline, frame))
+
+				if self.on_frame is not None:
+					self.on_frame(frame, img_processed)
+				self.ring.release(frame)
+
+				METRICS.observe("frame", time.monotonic() - frame.timestamp)
+
+				# target processing period from the WaitKey setting, 0 runs at camera rate
+				self.scheduler.wait(self.params.waitKey / 1000)
+		finally:
+			with self._state:
+				self._isRunning = False
+			self.close()
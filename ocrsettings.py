@@ -0,0 +1,53 @@
+# coding: utf8
+
+from PySide6.QtCore import QSettings
+
+from ocrpipeline import OcrCoordinate, ScOcrWorkerParams
+
+def loadSettings(path):
+	"""Opens a settings.ini written by the GUI, without needing a QApplication."""
+	qsettings = QSettings(path, QSettings.IniFormat)
+	qsettings.setFallbacksEnabled(False)
+	return qsettings
+
+def coordinatesFromSettings(qsettings):
+	"""Digit groups saved by the GUI, as OcrCoordinate in their saved order."""
+	loaded = qsettings.value("newOCRcoordinates")
+	if not loaded:
+		return []
+	return [OcrCoordinate(coord[0], coord[1]) for key, coord in loaded.items()]
+
+def paramsFromSettings(qsettings, **overrides):
+	"""ScOcrWorkerParams from the values the GUI saves; keyword arguments replace single parameters."""
+	params = dict(
+		waitKey=qsettings.value("SCwaitKey", "40"),
+		videoCaptureIndex=qsettings.value("SCvideoCaptureIndex", "0"),
+		rotation=qsettings.value("SCrotation", "0"),
+		skewx=qsettings.value("SCskewx", "0"),
+		skewy=qsettings.value("SCskewy", "0"),
+		erosion=qsettings.value("SCerosion", "0"),
+		dilate=qsettings.value("SCdilate", "0"),
+		# the GUI saves the threshold as SCThreshold but reads SCthreshold
+		threshold=qsettings.value("SCThreshold", qsettings.value("SCthreshold", "127")),
+		cropLeft=qsettings.value("LCrop", "0"),
+		cropTop=qsettings.value("TCrop", "0"),
+		autocrop_enabled=False,
+		autocrop_coords=[0,0,0,0],
+		roiOnly=qsettings.value("SCroiOnly", "1") == "1",
+		changeTolerance=qsettings.value("SCchangeTolerance", "8"),
+		lockLayoutFrames=qsettings.value("SClockLayoutFrames", "50"),
+		previewEnabled=qsettings.value("SCpreview", "1") == "1",
+		previewInterval=qsettings.value("SCpreviewInterval", "200"),
+		previewScale=qsettings.value("SCpreviewScale", "0.5"),
+		captureDecimation=qsettings.value("SCcaptureDecimation", "1"),
+		captureFps=qsettings.value("SCcaptureFps", "0"),
+		sourceFourcc=qsettings.value("SCsourceFourcc", ""),
+		sourceWidth=qsettings.value("SCsourceWidth", "960"),
+		sourceHeight=qsettings.value("SCsourceHeight", "540"),
+		sourceFps=qsettings.value("SCsourceFps", "0"),
+		sourceBufferSize=qsettings.value("SCsourceBufferSize", "0"),
+		sourceMinGroupHeight=qsettings.value("SCsourceMinGroupHeight", "0"),
+		groupThreads=qsettings.value("SCgroupThreads", "1")
+	)
+	params.update(overrides)
+	return ScOcrWorkerParams(**params)
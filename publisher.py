@@ -0,0 +1,163 @@
+# coding: utf8
+
+import logging
+import struct
+import threading
+
+from datetime import datetime
+
+class OcrResult():
+	"""Snapshot of the digit group values of one processed frame."""
+	def __init__(self, groups, timestamp, index):
+		self.groups = groups # [(name, value)] in digit group order
+		self.timestamp = timestamp # monotonic capture time of the frame
+		self.index = index # capture sequence number of the frame
+
+	@classmethod
+	def from_pipeline(cls, pipeline, frame):
+		return cls([(digitgrp.name, digitgrp.value) for digitgrp in pipeline.digit_groups], frame.timestamp, frame.index)
+
+class LatestValueMailbox():
+	"""Single-slot mailbox between a producer thread and a slower consumer.
+	A put replaces any value the consumer has not taken yet, so nothing queues
+	up behind a stalled consumer; replaced values are counted and handed to
+	discard, e.g. to release their buffers.
+	"""
+	def __init__(self, discard = None):
+		self.discard = discard
+		self.overwrites = 0
+		self._value = None
+		self._full = False
+		self._lock = threading.Lock()
+
+	def put(self, value):
+		"""Stores value; returns True when the mailbox was empty, i.e. the consumer needs a wake-up."""
+		with self._lock:
+			replaced = self._value if self._full else None
+			wasEmpty = not self._full
+			if self._full:
+				self.overwrites += 1
+			self._value = value
+			self._full = True
+		if replaced is not None and self.discard is not None:
+			self.discard(replaced)
+		return wasEmpty
+
+	def take(self):
+		"""Returns the newest value and empties the mailbox, or None when it is empty."""
+		with self._lock:
+			value = self._value if self._full else None
+			self._value = None
+			self._full = False
+			return value
+
+def resultMessage(msgType, seq, values, timestamp, prev = None):
+	"""Browser payload: a full "snapshot" of all groups or a "delta" with only the changed ones.
+	seq numbers the deltas, a snapshot carries the seq of the last delta it includes.
+	A delta's prev is the seq of the previous delta the same client was sent, a client
+	that applied less than that missed one.
+	"""
+	message = {"type": msgType, "seq": seq, "timestamp": timestamp, "values": values}
+	if prev is not None:
+		message["prev"] = prev
+	return message
+
+#WebSocket subprotocol a client offers to receive packResult messages instead of JSON
+BINARY_SUBPROTOCOL = "scoreboard-ocr.bin.v1"
+
+RESULT_SNAPSHOT = 1
+RESULT_DELTA = 2
+RESULT_TYPES = {"snapshot": RESULT_SNAPSHOT, "delta": RESULT_DELTA}
+
+#type, reserved, group count, seq, prev, monotonic capture time in microseconds
+RESULT_HEADER = struct.Struct("!BBHIIQ")
+REMOVED_LENGTH = 0xFF # value length of a group that is gone
+
+def packResult(msgType, seq, values, captured, prev = 0):
+	"""Binary counterpart of resultMessage: RESULT_HEADER followed by one entry per group,
+	a length-prefixed UTF-8 name and a length-prefixed UTF-8 value.
+	captured is the time.monotonic() capture time of the frame.
+	"""
+	data = bytearray(RESULT_HEADER.pack(RESULT_TYPES[msgType], 0, len(values), seq, prev, int(captured * 1000000)))
+	for name, value in values.items():
+		name = name.encode('utf8')
+		if len(name) >= REMOVED_LENGTH:
+			raise ValueError("group name too long for the binary format: {}".format(name))
+		data.append(len(name))
+		data += name
+		if value is None:
+			data.append(REMOVED_LENGTH)
+		else:
+			value = str(value).encode('utf8')
+			if len(value) >= REMOVED_LENGTH:
+				raise ValueError("group value too long for the binary format: {}".format(value))
+			data.append(len(value))
+			data += value
+	return bytes(data)
+
+def unpackResult(data):
+	"""Decodes packResult data into (msgType, seq, prev, captured in microseconds, {name: value})."""
+	msgType, reserved, count, seq, prev, captured = RESULT_HEADER.unpack_from(data)
+	offset = RESULT_HEADER.size
+	values = {}
+	for i in range(count):
+		length = data[offset]
+		name = data[offset + 1:offset + 1 + length].decode('utf8')
+		offset += 1 + length
+		length = data[offset]
+		if length == REMOVED_LENGTH:
+			values[name] = None
+			offset += 1
+		else:
+			values[name] = data[offset + 1:offset + 1 + length].decode('utf8')
+			offset += 1 + length
+	return msgType, seq, prev, captured, values
+
+def wallClock():
+	return datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+class ResultDelta():
+	"""Remembers the last published value of every group and numbers the changes."""
+	def __init__(self):
+		self.values = {}
+		self.seq = 0
+
+	def update(self, result):
+		"""Returns (seq, {name: value}) of the groups that changed, or None when nothing did.
+		Groups that are gone are reported with the value None.
+		"""
+		current = dict(result.groups)
+		changes = {name: value for name, value in current.items() if name not in self.values or self.values[name] != value}
+		for name in self.values:
+			if name not in current:
+				changes[name] = None
+		if not changes:
+			return None
+		self.values = current
+		self.seq += 1
+		return self.seq, changes
+
+class ResultPublisher():
+	"""Fans the results out to subscribers on the OCR thread.
+	Subscribers must only hand the result over to their own thread and return,
+	e.g. through a LatestValueMailbox or reactor.callFromThread.
+	"""
+	def __init__(self):
+		self.subscribers = ()
+		self._lock = threading.Lock()
+
+	def subscribe(self, callback):
+		with self._lock:
+			if callback not in self.subscribers:
+				self.subscribers = self.subscribers + (callback,)
+
+	def unsubscribe(self, callback):
+		with self._lock:
+			self.subscribers = tuple(subscriber for subscriber in self.subscribers if subscriber != callback)
+
+	def publish(self, result):
+		for subscriber in self.subscribers:
+			try:
+				subscriber(result)
+			except Exception as e:
+				logging.exception(e)
@@ -0,0 +1,117 @@
+# coding: utf8
+
+"""The single-pass morphology must give the same pixels as the HSV threshold
+and the iterated 2x2 erode/dilate it replaced, and locked digit layouts must
+still follow the board.
+
+	python -m pytest test_ocrpipeline.py
+"""
+
+import cv2
+import numpy
+import pytest
+
+from benchmark_groups import DIGIT_HEIGHT, DIGIT_WIDTH, DIGITS, SEGMENTS
+from ocrpipeline import DigitGroupType, OcrCoordinate, OcrPipeline, ScOcrWorkerParams, morphologyKernel
+
+ITERATIONS = range(1, 9)
+THRESHOLDS = (0, 1, 64, 127, 200, 254, 255)
+
+def randomBinary(rng, shape = (120, 160)):
+	return numpy.where(rng.random(shape) < 0.5, 255, 0).astype(numpy.uint8)
+
+def randomBgr(rng, shape = (120, 160, 3)):
+	return rng.integers(0, 256, shape, dtype = numpy.uint8)
+
+def morphologyPipeline(threshold, erosion = 0, dilate = 0):
+	params = ScOcrWorkerParams(0, "", 0, 0, 0, erosion, dilate, threshold, 0, 0, False, [0, 0, 0, 0], previewEnabled = False)
+	return OcrPipeline([], params)
+
+def referenceMorphology(img, threshold, erosion, dilate):
+	"""adjust_img_morphology before the single-pass rewrite."""
+	h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+	img_th = cv2.threshold(v, threshold, 255, cv2.THRESH_BINARY)[1]
+	img_processed = cv2.erode(img_th, numpy.ones((2, 2), numpy.uint8), iterations = erosion)
+	return cv2.dilate(img_processed, numpy.ones((2, 2), numpy.uint8), iterations = dilate)
+
+@pytest.mark.parametrize("iterations", ITERATIONS)
+def test_kernel_matches_iterated_erode(iterations):
+	rng = numpy.random.default_rng(iterations)
+	kernel, anchor = morphologyKernel(iterations)
+	for i in range(5):
+		img = randomBinary(rng)
+		expected = cv2.erode(img, numpy.ones((2, 2), numpy.uint8), iterations = iterations)
+		assert numpy.array_equal(cv2.erode(img, kernel, anchor = anchor), expected)
+
+@pytest.mark.parametrize("iterations", ITERATIONS)
+def test_kernel_matches_iterated_dilate(iterations):
+	rng = numpy.random.default_rng(100 + iterations)
+	kernel, anchor = morphologyKernel(iterations)
+	for i in range(5):
+		img = randomBinary(rng)
+		expected = cv2.dilate(img, numpy.ones((2, 2), numpy.uint8), iterations = iterations)
+		assert numpy.array_equal(cv2.dilate(img, kernel, anchor = anchor), expected)
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_threshold_matches_hsv_value(threshold):
+	rng = numpy.random.default_rng(threshold)
+	pipeline = morphologyPipeline(threshold)
+	for i in range(5):
+		img = randomBgr(rng)
+		expected = cv2.threshold(cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))[2], threshold, 255, cv2.THRESH_BINARY)[1]
+		assert numpy.array_equal(pipeline.adjust_img_morphology(img), expected)
+
+@pytest.mark.parametrize("threshold, erosion, dilate", [(127, 1, 1), (200, 4, 5), (64, 0, 3), (235, 4, 0)])
+def test_morphology_matches_reference(threshold, erosion, dilate):
+	rng = numpy.random.default_rng(threshold + erosion * 10 + dilate)
+	pipeline = morphologyPipeline(threshold, erosion, dilate)
+	for i in range(3):
+		img = randomBgr(rng)
+		assert numpy.array_equal(pipeline.adjust_img_morphology(img), referenceMorphology(img, threshold, erosion, dilate))
+
+def drawDigits(value, width = 240, height = 110):
+	"""Seven-segment digits 60 px apart on a dark frame, spaces are blank digits."""
+	img = numpy.full((height, width, 3), 20, numpy.uint8)
+	for i, digit in enumerate(value):
+		if digit == " ":
+			continue
+		x, y = 20 + i * 60, 20
+		for segment in DIGITS[int(digit)]:
+			x0, y0, x1, y1 = SEGMENTS[segment]
+			cv2.rectangle(img, (int(x + x0 * DIGIT_WIDTH), int(y + y0 * DIGIT_HEIGHT)), (int(x + x1 * DIGIT_WIDTH) - 1, int(y + y1 * DIGIT_HEIGHT) - 1), (40, 60, 250), -1)
+	return img
+
+def layoutPipeline(changeTolerance, lockLayoutFrames = 5):
+	params = ScOcrWorkerParams(0, "", 0, 0, 0, 1, 1, 127, 0, 0, False, [0, 0, 0, 0], changeTolerance = changeTolerance, lockLayoutFrames = lockLayoutFrames, previewEnabled = False)
+	return OcrPipeline([OcrCoordinate("score", [0, 0, 240, 110])], params)
+
+def readFrames(pipeline, img, count):
+	for i in range(count):
+		pipeline.process_frame(img)
+	return pipeline.readings()["score"]
+
+@pytest.mark.parametrize("changeTolerance", [None, 8])
+def test_locked_layout_finds_new_digit(changeTolerance):
+	pipeline = layoutPipeline(changeTolerance)
+	# noise keeps the frames changing, so the layout locks with change detection on as well
+	frames = [drawDigits(" 9"), drawDigits(" 9")]
+	frames[1][2:7, 2:7] = 255
+	for i in range(20):
+		pipeline.process_frame(frames[i % 2])
+	assert pipeline.digit_groups[0].type == DigitGroupType.SINGLE
+	assert pipeline.readings()["score"] == "9"
+	assert readFrames(pipeline, drawDigits("29"), 10) == "29"
+
+def test_reset_layout_reads_static_board():
+	pipeline = layoutPipeline(8)
+	img = drawDigits("29")
+	assert readFrames(pipeline, img, 10) == "29"
+	pipeline.reset_layout()
+	assert readFrames(pipeline, img, 3) == "29"
+
+@pytest.mark.parametrize("previewEnabled", [False, True])
+def test_preview_binarizes_whole_frame(previewEnabled):
+	params = ScOcrWorkerParams(0, "", 0, 0, 0, 0, 0, 127, 0, 0, False, [0, 0, 0, 0], previewEnabled = previewEnabled)
+	pipeline = OcrPipeline([OcrCoordinate("score", [0, 0, 120, 110])], params)
+	img_processed = pipeline.process_frame(numpy.full((110, 240, 3), 255, numpy.uint8))
+	assert cv2.countNonZero(img_processed[:, 120:]) == (120 * 110 if previewEnabled else 0)
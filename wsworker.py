@@ -3,43 +3,180 @@
 from PySide6 import QtCore
 
 import os, sys
+import json
+import time
+
+from fnmatch import fnmatchcase
 
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory, listenWS
-from twisted.internet import reactor
+from twisted.internet import reactor, task
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import log
+from twisted.web.resource import Resource
 from twisted.web.server import Site
 from twisted.web.static import File
+from zope.interface import implementer
+
+from metrics import METRICS
+from publisher import BINARY_SUBPROTOCOL, ResultDelta, packResult, resultMessage, wallClock
 
 if getattr(sys, 'frozen', False):
 	_applicationPath = os.path.dirname(sys.executable)
 elif __file__:
 	_applicationPath = os.path.dirname(__file__)
 
+class MetricsResource(Resource):
+	"""Serves the OCR stage latencies and counters, as JSON or Prometheus text."""
+	isLeaf = True
+
+	def __init__(self, metrics = METRICS, fmt = "prometheus"):
+		Resource.__init__(self)
+		self.metrics = metrics
+		self.fmt = fmt
+
+	def render_GET(self, request):
+		if self.fmt == "json":
+			request.setHeader(b"content-type", b"application/json")
+			return json.dumps(self.metrics.snapshot()).encode('utf8')
+		request.setHeader(b"content-type", b"text/plain; version=0.0.4")
+		return self.metrics.prometheus().encode('utf8')
+
+class ClientsResource(Resource):
+	"""Serves the outbound state of every connected WebSocket client as JSON."""
+	isLeaf = True
+
+	def __init__(self, factory):
+		Resource.__init__(self)
+		self.factory = factory
+
+	def render_GET(self, request):
+		request.setHeader(b"content-type", b"application/json")
+		return json.dumps(self.factory.client_stats()).encode('utf8')
+
+def topicMatches(name, topics):
+	"""True when a group name matches one of a client's glob patterns; None subscribes to all groups."""
+	return topics is None or any(fnmatchcase(name, pattern) for pattern in topics)
+
+def queuedBytes(transport):
+	"""Bytes a Twisted TCP transport accepted but did not write to the socket yet."""
+	return len(getattr(transport, 'dataBuffer', b'')) - getattr(transport, 'offset', 0) + getattr(transport, '_tempDataLen', 0)
+
+def webRoot(factory):
+	"""Static files of the application directory plus the metrics and client routes of factory."""
+	webdir = File(_applicationPath)
+	webdir.indexNames = ['index.php', 'index.html']
+	webdir.putChild(b'metrics', MetricsResource(fmt = "prometheus"))
+	webdir.putChild(b'metrics.json', MetricsResource(fmt = "json"))
+	webdir.putChild(b'clients.json', ClientsResource(factory))
+	return webdir
+
 class WebSocketsWorker(QtCore.QThread):
-	updateProgress = QtCore.Signal(list)
 	error = QtCore.Signal(str)
 	socket_opened = QtCore.Signal(int)
 
+	@implementer(IPushProducer)
 	class BroadcastServerProtocol(WebSocketServerProtocol):
+		"""Also the producer of its own transport: Twisted pauses it while the
+		client's send buffer is full and resumes it once the buffer drained.
+		"""
+		paused_at = None # monotonic time the send buffer filled up, None while it drains
+		stale = False # deltas were skipped while paused, a snapshot is due on resume
+		dropped = 0
+		topics = None # sorted tuple of group name patterns, None for all groups
+		binary = False # negotiated BINARY_SUBPROTOCOL, sent packResult messages instead of JSON
+
+		def onConnect(self, request):
+			# machine consumers opt into the packed format, browsers keep the JSON default
+			if BINARY_SUBPROTOCOL in request.protocols:
+				self.binary = True
+				return BINARY_SUBPROTOCOL
+			return None
+
 		def onOpen(self):
+			self.registerProducer(self, True)
 			self.factory.register(self)
+			self.factory.resync(self)
+
+		def pauseProducing(self):
+			if self.paused_at is None:
+				self.paused_at = time.monotonic()
+
+		def resumeProducing(self):
+			self.paused_at = None
+			if self.stale:
+				# all the skipped deltas collapse into the newest snapshot
+				self.stale = False
+				self.factory.resync(self)
+
+		def stopProducing(self):
+			self.paused_at = None
 
 		def onMessage(self, payload, isBinary):
-			if not isBinary:
-				msg = "{} from {}".format(payload.decode('utf8'), self.peer)
-				self.factory.broadcast(msg)
+			"""Handles {"type": "resync"} and {"type": "subscribe", "groups": [patterns]};
+			anything else, including groups that are not a list of strings, is ignored.
+			"""
+			if isBinary:
+				return
+			try:
+				request = json.loads(payload.decode('utf8'))
+			except ValueError:
+				return
+			if not isinstance(request, dict):
+				return
+			# a client that noticed a gap in the delta sequence asks for a full snapshot
+			if request.get("type") == "resync":
+				self.factory.resync(self)
+			elif request.get("type") == "subscribe":
+				groups = request.get("groups")
+				if isinstance(groups, str):
+					groups = [groups]
+				if groups is not None and not (isinstance(groups, list) and all(isinstance(pattern, str) for pattern in groups)):
+					return
+				self.topics = tuple(sorted(set(groups))) if groups else None
+				self.factory.resync(self)
 
 		def connectionLost(self, reason):
 			WebSocketServerProtocol.connectionLost(self, reason)
 			self.factory.unregister(self)
 
 	class BroadcastServerFactory(WebSocketServerFactory):
-		def __init__(self, url, debug=False, debugCodePaths=False):
+		def __init__(self, url, debug=False, debugCodePaths=False, maxLag=5.0):
 			WebSocketServerFactory.__init__(self, url)
-			self.clients = []
+			self.max_lag = maxLag # seconds a client may stay backed up before it is disconnected
+			self.clients = set()
 			self.tickcount = 0
+			self.seq = 0 # seq of the last delta, the snapshot below includes it
+			self.values = {}
+			self.timestamp = None
+			self.captured = 0.0 # monotonic capture time of the frame of the last delta
+			self.changed_at = {} # seq of the last delta that changed or removed each group
+			self.snapshots = {} # prepared snapshot message per topics, rebuilt after the next delta
+			self.lag_check = None # LoopingCall that drops clients backed up for longer than max_lag
 			#self.tick()
 
+		def startFactory(self):
+			WebSocketServerFactory.startFactory(self)
+			# clients are also dropped while no values change, e.g. during a timeout
+			self.lag_check = task.LoopingCall(self.check_lag)
+			self.lag_check.start(min(1.0, self.max_lag / 2), now = False)
+
+		def stopFactory(self):
+			if self.lag_check is not None and self.lag_check.running:
+				self.lag_check.stop()
+			WebSocketServerFactory.stopFactory(self)
+
+		def check_lag(self):
+			now = time.monotonic()
+			for c in list(self.clients):
+				if c.paused_at is not None and now - c.paused_at > self.max_lag:
+					self.drop_slow(c)
+
+		def drop_slow(self, client):
+			print(("disconnecting slow client {}, {} bytes queued".format(client.peer, queuedBytes(client.transport))))
+			METRICS.increment("ws_slow_disconnects")
+			client.paused_at = None # dropped once, connectionLost unregisters it
+			client.dropConnection(abort=True)
+
 		def tick(self):
 			self.tickcount += 1
 			self.broadcast("tick %d from server" % self.tickcount)
@@ -48,31 +185,106 @@ class WebSocketsWorker(QtCore.QThread):
 		def register(self, client):
 			if client not in self.clients:
 				print(("registered client {}".format(client.peer)))
-				self.clients.append(client)
+				self.clients.add(client)
 
 		def unregister(self, client):
 			if client in self.clients:
 				print(("unregistered client {}".format(client.peer)))
-				self.clients.remove(client)
+				self.clients.discard(client)
 
 		def broadcast(self, msg):
 			#print("broadcasting message '{}' ..".format(msg))
+			prepared = self.prepareMessage(msg.encode('utf8'))
 			for c in self.clients:
-				c.sendMessage(msg.encode('utf8'))
+				c.sendPreparedMessage(prepared)
 				#print("message {} sent to {}".format(msg, c.peer))
 
-		def returnClients(self):
-			return
-			#for c in self.clients:
-				#print(c.peer)
+		def publish_delta(self, seq, changes, timestamp, captured, payload):
+			"""Applies a delta to the snapshot kept for new clients and sends each client
+			the part it subscribed to. payload is the UTF-8 encoded JSON message with all
+			changes; every distinct subscription and format is encoded and framed once.
+			"""
+			for name, value in changes.items():
+				if value is None:
+					self.values.pop(name, None)
+				else:
+					self.values[name] = value
+			self.seq = seq
+			self.timestamp = timestamp
+			self.captured = captured
+			self.snapshots = {}
 
+			now = time.monotonic()
+			streams = {(False, None): self.prepareMessage(payload)}
+			coalesced = 0
+			for c in list(self.clients):
+				stream = (c.binary, c.topics)
+				if stream not in streams:
+					streams[stream] = self.prepare_delta(c.binary, c.topics, seq, changes)
+				prepared = streams[stream]
+				if prepared is None:
+					continue
+				if c.paused_at is None:
+					c.sendPreparedMessage(prepared)
+					continue
+				c.stale = True
+				c.dropped += 1
+				coalesced += 1
+				if now - c.paused_at > self.max_lag:
+					self.drop_slow(c)
+			if coalesced:
+				METRICS.increment("ws_coalesced", coalesced)
+			for name in changes:
+				self.changed_at[name] = seq
 
-	def __init__(self, serverAddress=None):
+		def prepare_delta(self, binary, topics, seq, changes):
+			"""Frames the subscribed part of the last delta, None when it has none.
+			Must run before changed_at records this delta.
+			"""
+			values = {name: value for name, value in changes.items() if topicMatches(name, topics)}
+			if not values:
+				return None
+			prev = max([changedSeq for name, changedSeq in self.changed_at.items() if topicMatches(name, topics)], default = 0)
+			return self.prepare_result("delta", binary, seq, values, prev)
+
+		def prepare_result(self, msgType, binary, seq, values, prev = None):
+			if binary:
+				return self.prepareMessage(packResult(msgType, seq, values, self.captured, prev or 0), isBinary=True)
+			msg = json.dumps(resultMessage(msgType, seq, values, self.timestamp, prev))
+			return self.prepareMessage(msg.encode('utf8'))
+
+		def resync(self, client):
+			# a backed up client gets its snapshot once its send buffer drained
+			if client.paused_at is not None:
+				client.stale = True
+				return
+			# connects and resumes come in bursts, they all share one framed snapshot per seq, subscription and format
+			stream = (client.binary, client.topics)
+			prepared = self.snapshots.get(stream)
+			if prepared is None:
+				values = {name: value for name, value in self.values.items() if topicMatches(name, client.topics)}
+				prepared = self.snapshots[stream] = self.prepare_result("snapshot", client.binary, self.seq, values)
+			client.sendPreparedMessage(prepared)
+
+		def client_stats(self):
+			now = time.monotonic()
+			return [{
+				"peer": c.peer,
+				"queued_bytes": queuedBytes(c.transport),
+				"dropped": c.dropped,
+				"topics": c.topics,
+				"binary": c.binary,
+				"lag": now - c.paused_at if c.paused_at is not None else 0.0
+			} for c in self.clients]
+
+
+	def __init__(self, serverAddress=None, maxLag=5.0):
 		QtCore.QThread.__init__(self)
 		if serverAddress is None:
-			self.factory = self.BroadcastServerFactory("ws://localhost:9000", debug=False, debugCodePaths=False)
+			self.factory = self.BroadcastServerFactory("ws://localhost:9000", debug=False, debugCodePaths=False, maxLag=maxLag)
 		else:
-			self.factory = self.BroadcastServerFactory(serverAddress, debug=False, debugCodePaths=False)
+			self.factory = self.BroadcastServerFactory(serverAddress, debug=False, debugCodePaths=False, maxLag=maxLag)
+		self.delta = ResultDelta() # only touched by the OCR thread
 
 	def run(self):
 		self.factory.protocol = self.BroadcastServerProtocol
@@ -80,9 +292,7 @@ class WebSocketsWorker(QtCore.QThread):
 			listenWS(self.factory)
 		except:
 			self.error.emit("Fail")
-		webdir = File(_applicationPath)
-		webdir.indexNames = ['index.php', 'index.html']
-		web = Site(webdir)
+		web = Site(webRoot(self.factory))
 		try:
 			reactor.listenTCP(8080, web)
 			self.socket_opened.emit(1)
@@ -90,6 +300,21 @@ class WebSocketsWorker(QtCore.QThread):
 			self.error.emit("Fail")
 		reactor.run(installSignalHandlers=0)
 
-	def send(self, data):
-		reactor.callFromThread(self.factory.broadcast, data)
-		self.updateProgress.emit([self.factory.returnClients()])
\ No newline at end of file
+	def publish_result(self, result):
+		"""ResultPublisher subscriber: diffs and encodes on the OCR thread and broadcasts
+		without going through the GUI. Frames that changed nothing are not sent.
+		"""
+		delta = self.delta.update(result)
+		if delta is None:
+			METRICS.increment("results_unchanged")
+			return
+		seq, changes = delta
+		timestamp = wallClock()
+		# every delta changes something, so the previous one is the previous delta of the full stream
+		data = json.dumps(resultMessage("delta", seq, changes, timestamp, seq - 1)).encode('utf8')
+		reactor.callFromThread(self.broadcast_result, result, seq, changes, timestamp, data)
+
+	def broadcast_result(self, result, seq, changes, timestamp, data):
+		with METRICS.timer("ws_send"):
+			self.factory.publish_delta(seq, changes, timestamp, result.timestamp, data)
+		METRICS.observe("result_ws", time.monotonic() - result.timestamp)
\ No newline at end of file